@@ -5,11 +5,21 @@
 #   streamlit run app.py --server.fileWatcherType=none
 
 from pathlib import Path
+import json
+from concurrent.futures import Future, ThreadPoolExecutor
 import streamlit as st
 import duckdb
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyproj
+import shapely
 import folium
+from folium.elements import JSCSSMixin
+from branca.element import MacroElement
+from jinja2 import Template
 from streamlit_folium import st_folium
 import altair as alt
 
@@ -26,6 +36,18 @@ def fmt_float2_br(x: float) -> str:
     except Exception:
         return str(x)
 
+def fmt_float2_br_series(s: pd.Series) -> pd.Series:
+    """fmt_float2_br vetorizado (operações de string do pandas, sem função Python por linha)."""
+    v = pd.to_numeric(s, errors="coerce").astype(float)
+    ok = np.isfinite(v)   # NaN/±inf caem no astype(str) abaixo, como no fmt_float2_br escalar
+    cents = (v[ok].abs() * 100).round().astype("int64")
+    inteiro = (cents // 100).astype(str).str.replace(r"(\d)(?=(\d{3})+$)", r"\1.", regex=True)
+    frac = (cents % 100).astype(str).str.zfill(2)
+    sinal = pd.Series(np.where(v[ok] < 0, "-", ""), index=cents.index)
+    out = s.astype(str)
+    out[ok] = sinal + inteiro + "," + frac
+    return out
+
 # ordem e cores fixas por faixa (gráficos + mapa)
 ORDER_RINGS = ["0-5km", "5-10km", "10-20km", ">20km"]
 RING_COLORS = {
@@ -45,7 +67,9 @@ PROC = DATA / "processed"
 INTER_DIR = PROC / "intersection"
 DB_PATH = INTER_DIR / "intersections.duckdb"              # criado por scripts/06_build_duckdb.py
 PARQUET_PATH = INTER_DIR / "inter_prodes_rings.parquet"   # criado por scripts/04_intersection.py ou 05_precompute_intersections.py
-RINGS_PATH = PROC / "buffers" / "buffer_rings.shp"
+RINGS_PATH = PROC / "buffers" / "buffer_rings.parquet"       # criado por scripts/03_create_buffers.py
+PMTILES_PATH = PROJ / "static" / "inter.pmtiles"         # opcional: criado por scripts/08_build_pmtiles.py
+PMTILES_URL = "/app/static/inter.pmtiles"                # servido pelo Streamlit (enableStaticServing)
 AOI_PATH = PROC / "roraima_aoi.geojson"
 WGS84 = "EPSG:4326"
 
@@ -53,10 +77,15 @@ st.set_page_config(page_title="Roraima — Desmatamento (PRODES) vs. Proximidade
 
 # ---------- Municípios (IBGE) ----------
 MUN_PATH = DATA / "external" / "ibge_municipal" / "RR_Municipios_2024.shp"
+MUN_PARQUET = MUN_PATH.with_name("RR_Municipios.parquet")   # criado por scripts/07_tag_muni.py
 
-@st.cache_data(show_spinner=False)
+@st.cache_resource(show_spinner=False)
 def load_municipios(path: Path) -> gpd.GeoDataFrame:
-    gdf = gpd.read_file(path)
+    # GeoParquet já limpo (MUN_NAME + geometry, WGS84) quando existir; senão, shapefile via pyogrio
+    parquet = path.with_name(MUN_PARQUET.name)
+    if parquet.exists():
+        return gpd.read_parquet(parquet)
+    gdf = gpd.read_file(path, engine="pyogrio")
     if gdf.crs is None:
         gdf = gdf.set_crs(WGS84)
     gdf = gdf.to_crs(WGS84)
@@ -82,38 +111,170 @@ else:
 # Helpers
 # -----------------------
 
-def duck_query(sql: str, params=None) -> pd.DataFrame:
-    con = duckdb.connect(DB_PATH.as_posix(), read_only=True)
+@st.cache_resource(show_spinner=False)
+def _duck_con() -> duckdb.DuckDBPyConnection:
+    # conexão única (somente leitura) reaproveitada entre reruns/sessões;
+    # obs.: enquanto o app roda, os scripts 06/07 não conseguem gravar no .duckdb
+    return duckdb.connect(DB_PATH.as_posix(), read_only=True)
+
+def duck_query(sql: str, params=None, arrow: bool = False) -> pd.DataFrame | pa.Table:
+    # um cursor por chamada: conexões DuckDB não devem ser compartilhadas entre threads
+    cur = _duck_con().cursor()
     try:
-        df = con.execute(sql, params or {}).fetchdf()
+        res = cur.execute(sql, params or [])
+        # arrow=True: tabela Arrow direto (gráficos), sem materializar pandas
+        return res.fetch_arrow_table() if arrow else res.fetch_df()
     finally:
-        con.close()
-    return df
+        cur.close()
+
+def duck_has_table(name: str) -> bool:
+    df = duck_query("SELECT 1 FROM information_schema.tables WHERE table_name = ?;", [name])
+    return not df.empty
 
 @st.cache_data(show_spinner=False)
 def load_gdf(path: Path) -> gpd.GeoDataFrame:
-    gdf = gpd.read_file(path)
+    # já devolve em WGS84: a reprojeção fica dentro do cache (não se repete a cada rerun)
+    if path.suffix == ".parquet":
+        gdf = gpd.read_parquet(path)
+    else:
+        gdf = gpd.read_file(path, engine="pyogrio")
     if gdf.crs is None:
         gdf = gdf.set_crs(WGS84)
-    return gdf
+    return to_wgs84(gdf)
+
+def to_wgs84(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Reprojeta para WGS84 só se necessário (no-op quando já está em lon/lat)."""
+    if gdf.crs is None or gdf.crs.equals(WGS84, ignore_axis_order=True):
+        return gdf
+    return gdf.to_crs(WGS84)
+
+def _geoparquet_crs(schema: pa.Schema, geom_col: str = "geometry"):
+    """CRS gravado nos metadados 'geo' do GeoParquet (PROJJSON); padrão da spec = OGC:CRS84."""
+    meta = (schema.metadata or {}).get(b"geo")
+    if not meta:
+        return WGS84
+    crs = json.loads(meta).get("columns", {}).get(geom_col, {}).get("crs", "OGC:CRS84")
+    if crs is None:
+        return None
+    return pyproj.CRS.from_json_dict(crs) if isinstance(crs, dict) else crs
+
+# cache_resource: o GeoDataFrame é compartilhado (não é serializado/copiado a cada acesso)
+@st.cache_resource(show_spinner=False, max_entries=8)
+def load_intersection_parquet(path: Path, mtime: float, ymin: int, ymax: int, rings: tuple[str, ...]) -> gpd.GeoDataFrame:
+    """
+    Lê só as colunas/linhas necessárias: filtro por ano/anel empurrado para o leitor Parquet
+    (row groups descartados pelas estatísticas) e WKB decodificado só para o que sobrou.
+    `mtime` só entra na chave do cache: Parquet regravado (04/05/07) invalida as entradas antigas.
+    """
+    dset = ds.dataset(path, format="parquet")
+    names = dset.schema.names
+    year_col = next(c for c in names if c.lower() == "year")
+    # geom_map = geometria já simplificada na ingestão (04/05); senão, a original
+    geom_col = "geom_map" if "geom_map" in names else "geometry"
+    cols = [c for c in ["ring_id", year_col, "area_ha", "MUN_NAME", geom_col] if c in names]
+    flt = (ds.field(year_col) >= ymin) & (ds.field(year_col) <= ymax) & ds.field("ring_id").isin(list(rings))
+    table = dset.to_table(columns=cols, filter=flt)
+    # pyarrow + shapely.from_wkb em lote (~2x mais rápido que gpd.read_parquet)
+    geoms = shapely.from_wkb(table.column(geom_col).to_numpy(zero_copy_only=False))
+    data = {c: table.column(c).to_pandas() for c in cols if c != geom_col}
+    gdf = gpd.GeoDataFrame(data, geometry=geoms, crs=_geoparquet_crs(dset.schema, geom_col))
+    # geom_map já vem em WGS84; a geometria original (EPSG:5880) é reprojetada aqui, dentro do cache
+    return to_wgs84(gdf.rename(columns={year_col: "year"}))
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def parquet_has_column(path: Path, mtime: float, column: str) -> bool:
+    return column in ds.dataset(path, format="parquet").schema.names
+
+class PMTilesLayer(JSCSSMixin, MacroElement):
+    """Camada de tiles vetoriais (PMTiles) via protomaps-leaflet, filtrada no navegador por ano/anel/município."""
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = protomapsL.leafletLayer({
+            url: {{ this.url|tojson }},
+            paintRules: [{
+                dataLayer: {{ this.layer|tojson }},
+                symbolizer: new protomapsL.PolygonSymbolizer({
+                    fill: "#fb9a99", opacity: 0.35, stroke: "#e31a1c", width: 0.5
+                }),
+                filter: function(z, f) {
+                    var p = f.props;
+                    return p.year >= {{ this.ymin }} && p.year <= {{ this.ymax }}
+                        && {{ this.rings|tojson }}.indexOf(p.ring_id) >= 0
+                        {% if this.munis %}&& {{ this.munis|tojson }}.indexOf(p.MUN_NAME) >= 0{% endif %};
+                }
+            }],
+            labelRules: []
+        });
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+    default_js = [("protomaps_leaflet", "https://unpkg.com/protomaps-leaflet@4.0.1/dist/protomaps-leaflet.js")]
+
+    def __init__(self, url: str, ymin: int, ymax: int, rings: list[str], munis: list[str], layer: str = "inter"):
+        super().__init__()
+        self._name = "PMTilesLayer"
+        self.url, self.layer = url, layer
+        self.ymin, self.ymax = int(ymin), int(ymax)
+        self.rings, self.munis = list(rings), list(munis)
+
+# --- GeoJSON (texto) das camadas fixas do mapa: serializado uma vez por chave, não a cada rerun ---
+ROADS_SIMPLIFY_DEG = 0.00010
+ROADS_MAIN_CLASSES = ("motorway", "trunk", "primary", "secondary")
+MAP_PRECISION_DEG = 1e-5   # ~1 m: 5 casas decimais bastam para o navegador
+
+def to_map_precision(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Arredonda os vértices (grade de MAP_PRECISION_DEG) — GeoJSON bem menor, mesma aparência."""
+    geoms = shapely.set_precision(gdf.geometry.values, MAP_PRECISION_DEG)
+    out = gdf.set_geometry(gpd.GeoSeries(geoms, index=gdf.index, crs=gdf.crs))
+    return out[~out.geometry.is_empty]   # polígonos menores que a grade somem
+
+@st.cache_data(show_spinner=False)
+def aoi_geojson(path: Path) -> str:
+    return to_map_precision(load_gdf(path)).to_json()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def rings_geojson(path: Path, rings_key: tuple[str, ...]) -> str:
+    gdf = load_gdf(path)
+    return to_map_precision(gdf.loc[gdf["ring_id"].astype(str).isin(rings_key), ["ring_id", "geometry"]]).to_json()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def municipios_geojson(path: Path, muni_key: tuple[str, ...]) -> str:
+    gdf = load_municipios(path)
+    return to_map_precision(gdf[gdf["MUN_NAME"].isin(muni_key)]).to_json()
 
 @st.cache_data(show_spinner=False)
-def load_intersection_parquet(path: Path) -> gpd.GeoDataFrame:
-    return gpd.read_parquet(path)  # GeoParquet mantém geometria/CRS
+def roads_geojson(path: Path, simplify_tol: float) -> tuple[str, list[str], list[str]]:
+    """Rodovias principais (WGS84, simplificadas) + campos/aliases do tooltip."""
+    simpl_path = path.with_name("roads_rr_simpl.parquet")   # criado por scripts/01_prepare_osm_rr.py
+    if simpl_path.exists():
+        roads_wgs = gpd.read_parquet(simpl_path)  # já em WGS84, filtrado, simplificado e arredondado
+    else:
+        roads_wgs = gpd.read_parquet(path).to_crs(WGS84)
+        # simplifica SÓ para exibir
+        roads_wgs["geometry"] = roads_wgs.geometry.simplify(simplify_tol, preserve_topology=True)
+    # filtra classes principais para não sobrecarregar
+    if "fclass" in roads_wgs.columns:
+        roads_wgs = roads_wgs[roads_wgs["fclass"].isin(ROADS_MAIN_CLASSES)]
+
+    fields, aliases = [], []
+    for field, alias in [("ref", "BR/Ref"), ("name", "Nome")]:
+        if field in roads_wgs.columns:
+            fields.append(field); aliases.append(alias)
+    return to_map_precision(roads_wgs[fields + ["geometry"]]).to_json(), fields, aliases
 
 def sanitize_for_folium(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    df = gdf.copy()
-    for col in df.columns:
-        if col == "geometry":
-            continue
-        if pd.api.types.is_datetime64_any_dtype(df[col]):
-            df[col] = df[col].dt.strftime("%Y-%m-%d")
-        if col.lower() == "year":
-            try:
-                df[col] = df[col].astype(float).round().astype(int)
-            except Exception:
-                pass
-    return df
+    dt_cols = gdf.select_dtypes(include=["datetime", "datetimetz"]).columns
+    year_cols = [c for c in gdf.columns
+                 if c.lower() == "year" and not pd.api.types.is_integer_dtype(gdf[c])]
+    if len(dt_cols) == 0 and not year_cols:
+        return gdf  # nada a converter: evita copiar a coluna de geometria
+    repl = {c: gdf[c].dt.strftime("%Y-%m-%d") for c in dt_cols}
+    for c in year_cols:
+        try:
+            repl[c] = np.rint(gdf[c].to_numpy(dtype=float)).astype(np.int32)
+        except Exception:
+            pass
+    return gdf.assign(**repl)
 
 # -----------------------
 # Cargas fixas
@@ -124,9 +285,10 @@ if not DB_PATH.exists():
 if not PARQUET_PATH.exists():
     st.error(f"Parquet não encontrado: {PARQUET_PATH}\nRode: python scripts/04_intersection.py (ou 05_precompute_intersections.py)")
     st.stop()
+PARQUET_MTIME = PARQUET_PATH.stat().st_mtime   # chave dos caches lidos do GeoParquet
 
-rings = load_gdf(RINGS_PATH).to_crs(WGS84)
-aoi = load_gdf(AOI_PATH).to_crs(WGS84)
+rings = load_gdf(RINGS_PATH)   # já em WGS84
+aoi = load_gdf(AOI_PATH)
 
 # anos disponíveis via DuckDB
 yrs = duck_query("SELECT MIN(year) AS y0, MAX(year) AS y1 FROM by_ring_year;")
@@ -180,41 +342,83 @@ mun_sel = st.session_state.applied_filters.get("municipios", [])
 st.markdown("### Relatório (PDF)")
 
 import base64
-try:
-    import doc  # importa seu doc.py
 
-    # pega filtros atuais direto da session_state
-    ymin, ymax = st.session_state.applied_filters["years"]
-    mun_sel = st.session_state.applied_filters.get("municipios", [])
+PDF_CACHE_MAX = 8   # relatórios (por combinação de filtros) guardados em memória
 
-    if st.button("Gerar PDF com filtros atuais", type="primary"):
-        with st.spinner("Gerando relatório em PDF..."):
-            pdf_bytes = doc.build_pdf_bytes(
-                years=(ymin, ymax),
-                municipios_filtro=mun_sel if mun_sel else None
-            )
-        st.success("Relatório gerado!")
+@st.cache_resource(show_spinner=False)
+def _pdf_jobs() -> tuple[ThreadPoolExecutor, dict]:
+    # 1 worker: os PDFs saem um de cada vez (cada um já renderiza os gráficos em paralelo no doc.py)
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf"), {}
 
-        # Botão para baixar
-        st.download_button(
-            "Baixar PDF",
-            data=pdf_bytes,
-            file_name="relatorio_roraima.pdf",
-            mime="application/pdf",
-            use_container_width=True
-        )
+def pdf_future(ymin: int, ymax: int, muni_key: tuple[str, ...]) -> Future:
+    """Gera o PDF em segundo plano; filtros iguais reaproveitam o mesmo Future (sem regerar)."""
+    import doc  # importa seu doc.py
+    executor, jobs = _pdf_jobs()
+    key = (int(ymin), int(ymax), muni_key)
+    fut = jobs.get(key)
+    if fut is None or (fut.done() and fut.exception() is not None):
+        fut = executor.submit(doc.build_pdf_bytes, years=(key[0], key[1]),
+                              municipios_filtro=list(muni_key) or None)
+        jobs[key] = fut
+        while len(jobs) > PDF_CACHE_MAX:
+            jobs.pop(next(iter(jobs)))
+    return fut
+
+def pdf_status(fut: Future):
+    """Download + link do PDF pronto (ou o aviso, se a geração falhou)."""
+    try:
+        pdf_bytes = fut.result()
+    except Exception as e:
+        st.warning(f"Não foi possível gerar o PDF a partir do app: {e}")
+        return
+    st.success("Relatório gerado!")
+
+    # Botão para baixar
+    st.download_button(
+        "Baixar PDF",
+        data=pdf_bytes,
+        file_name="relatorio_roraima.pdf",
+        mime="application/pdf",
+        use_container_width=True
+    )
 
-        # Link para abrir em nova guia
-        b64 = base64.b64encode(pdf_bytes).decode("utf-8")
-        st.markdown(
-            f"<a href='data:application/pdf;base64,{b64}' target='_blank' "
-            f"style='text-decoration:none; padding:8px 12px; background:#2563eb; "
-            f"color:#fff; border-radius:8px; display:inline-block; margin-top:8px;'>"
-            f"Abrir em nova guia</a>",
-            unsafe_allow_html=True
-        )
-except Exception as e:
-    st.warning(f"Não foi possível gerar o PDF a partir do app: {e}")
+    # Link para abrir em nova guia
+    b64 = base64.b64encode(pdf_bytes).decode("utf-8")
+    st.markdown(
+        f"<a href='data:application/pdf;base64,{b64}' target='_blank' "
+        f"style='text-decoration:none; padding:8px 12px; background:#2563eb; "
+        f"color:#fff; border-radius:8px; display:inline-block; margin-top:8px;'>"
+        f"Abrir em nova guia</a>",
+        unsafe_allow_html=True
+    )
+
+def pdf_section(polling: bool):
+    # fragmento: clicar no botão reexecuta só esta seção (mapa e gráficos não são refeitos);
+    # `polling` = registrado com run_every (PDF em geração) — reexecuta sozinho a cada 2 s
+    try:
+        # pega filtros atuais direto da session_state
+        ymin, ymax = st.session_state.applied_filters["years"]
+        mun_sel = st.session_state.applied_filters.get("municipios", [])
+
+        if st.button("Gerar PDF com filtros atuais", type="primary"):
+            st.session_state.pdf_job = pdf_future(ymin, ymax, tuple(sorted(mun_sel)))
+            if not polling and not st.session_state.pdf_job.done():
+                st.rerun()   # run_every só muda no registro: um rerun do app religa a seção com polling
+        fut = st.session_state.get("pdf_job")
+        if fut is None:
+            return
+        if not fut.done():
+            st.info("Gerando relatório em PDF... (pode continuar usando o app)")
+            return
+        if polling:
+            st.rerun()   # pronto: um único rerun do app registra a seção de novo, já sem polling
+        pdf_status(fut)
+    except Exception as e:
+        st.warning(f"Não foi possível gerar o PDF a partir do app: {e}")
+
+# um único fragmento (sem fragmento aninhado): com PDF pendente ele mesmo faz o polling
+_pdf_pending = st.session_state.get("pdf_job") is not None and not st.session_state.pdf_job.done()
+st.fragment(pdf_section, run_every=2 if _pdf_pending else None)(_pdf_pending)
 
 
 
@@ -225,7 +429,7 @@ by_ring_year = duck_query("""
     SELECT ring_id, year, area_ha
     FROM by_ring_year
     WHERE year BETWEEN ? AND ?
-      AND ring_id IN (SELECT * FROM UNNEST(?))
+      AND list_contains(?::VARCHAR[], CAST(ring_id AS VARCHAR))
     ORDER BY year, ring_id;
 """, [ymin, ymax, rings_sel])
 
@@ -233,7 +437,7 @@ by_ring = duck_query("""
     SELECT ring_id, SUM(area_ha) AS area_ha
     FROM by_ring_year
     WHERE year BETWEEN ? AND ?
-      AND ring_id IN (SELECT * FROM UNNEST(?))
+      AND list_contains(?::VARCHAR[], CAST(ring_id AS VARCHAR))
     GROUP BY 1
     ORDER BY ring_id;
 """, [ymin, ymax, rings_sel])
@@ -241,62 +445,70 @@ by_ring = duck_query("""
 # -----------------------
 # Geometrias (SEM AMOSTRAGEM) para o mapa
 # -----------------------
-inter_all = load_intersection_parquet(PARQUET_PATH)
-year_col = next(c for c in inter_all.columns if c.lower() == "year")
-inter_f = inter_all[
-    inter_all[year_col].between(ymin, ymax)
-    & inter_all["ring_id"].astype(str).isin(rings_sel)
-].copy()
-
-# mantém colunas essenciais e projeta
-keep_cols = [c for c in ["ring_id", "year", "area_ha", "geometry"] if c in inter_f.columns]
-inter_map = inter_f[keep_cols].to_crs(WGS84) if not inter_f.empty else gpd.GeoDataFrame(geometry=[], crs=WGS84)
-inter_safe = sanitize_for_folium(inter_map)
-
-# ---------- Filtro espacial por município (se selecionado) ----------
+# ---------- Filtro por município (se selecionado) ----------
 using_muni_filter = municipios is not None and len(mun_sel) > 0
+if using_muni_filter and not duck_has_table("by_muni_ring_year"):
+    st.warning("Municípios não pré-calculados (tabela 'by_muni_ring_year') — filtro por município ignorado.\n"
+               "Rode: python scripts/07_tag_muni.py")
+    using_muni_filter = False
+
+# com PMTiles o navegador busca os tiles direto; não há geometria para carregar no Python.
+# Só vale se os tiles forem pelo menos tão novos quanto o GeoParquet (senão mostrariam outra
+# interseção) e, com filtro por município, se tiverem MUN_NAME — tiles mais novos que o Parquet
+# foram gerados a partir dele, então basta olhar o schema do Parquet
+USE_PMTILES = PMTILES_PATH.exists()
+if USE_PMTILES and PMTILES_PATH.stat().st_mtime < PARQUET_PATH.stat().st_mtime:
+    st.warning("PMTiles mais antigo que o GeoParquet — mapa em GeoJSON. Rode: python scripts/08_build_pmtiles.py")
+    USE_PMTILES = False
+if USE_PMTILES and using_muni_filter and not parquet_has_column(PARQUET_PATH, PARQUET_MTIME, "MUN_NAME"):
+    st.warning("PMTiles sem MUN_NAME — mapa em GeoJSON para aplicar o filtro por município. "
+               "Rode: python scripts/07_tag_muni.py e python scripts/08_build_pmtiles.py")
+    USE_PMTILES = False
+if USE_PMTILES:
+    inter_f = gpd.GeoDataFrame(geometry=[], crs=WGS84)
+else:
+    inter_f = load_intersection_parquet(PARQUET_PATH, PARQUET_MTIME, ymin, ymax, tuple(rings_sel))
+
+# mantém colunas essenciais (load_intersection_parquet já devolve em WGS84)
+keep_cols = [c for c in ["ring_id", "year", "area_ha", "MUN_NAME", "geometry"] if c in inter_f.columns]
+inter_map = inter_f[keep_cols] if not inter_f.empty else gpd.GeoDataFrame(geometry=[], crs=WGS84)
+
+
+def muni_agg(group_cols: list[str], order_by: str) -> pd.DataFrame:
+    """Agrega by_muni_ring_year no DuckDB (filtros atuais) — só o resultado pequeno volta ao Python."""
+    cols = ", ".join(group_cols)
+    return duck_query(f"""
+        SELECT {cols}, SUM(area_ha) AS area_ha
+        FROM by_muni_ring_year
+        WHERE year BETWEEN ? AND ?
+          AND list_contains(?::VARCHAR[], ring_id)
+          AND list_contains(?::VARCHAR[], MUN_NAME)
+        GROUP BY {cols}
+        ORDER BY {order_by};
+    """, [ymin, ymax, rings_sel, mun_sel])
 
 # vamos precisar dessas variáveis mais tarde
 inter_muni = gpd.GeoDataFrame(geometry=[], crs=WGS84)
 
-if using_muni_filter and not inter_map.empty:
-    # pega apenas os municípios escolhidos e leva o nome junto
-    mun_gdf = municipios[municipios["MUN_NAME"].isin(mun_sel)][["MUN_NAME", "geometry"]].copy()
-
-    # sjoin (intersects) – rápido com índice espacial
-    inter_muni = gpd.sjoin(
-        inter_map,                      # geometria já em WGS84
-        mun_gdf,
-        how="inner",
-        predicate="intersects"
-    ).drop(columns=["index_right"])
-
-    # Se não houver nada, evita quebrar
-    if inter_muni.empty:
+if using_muni_filter:
+    # agregados da seleção direto do DuckDB (sem geometria)
+    by_ring = muni_agg(["ring_id"], "ring_id")
+    by_ring_year = muni_agg(["ring_id", "year"], "year, ring_id")
+    if by_ring.empty:
         st.info("Nenhuma feição da interseção cai nos municípios selecionados.")
-        inter_safe_filtered = inter_muni
-        # zera agregados
-        by_ring = pd.DataFrame({"ring_id": [], "area_ha": []})
-        by_ring_year = pd.DataFrame({"ring_id": [], "year": [], "area_ha": []})
-    else:
-        # recalcula agregados para a seleção
-        by_ring = (
-            inter_muni.groupby("ring_id", as_index=False)["area_ha"].sum()
-            .sort_values("ring_id")
-        )
-        by_ring_year = (
-            inter_muni.groupby(["ring_id", "year"], as_index=False)["area_ha"].sum()
-            .sort_values(["year","ring_id"])
-        )
 
-        # geometria para o mapa (só selecionados)
-        inter_safe_filtered = inter_muni.copy()
+    # geometria só para o mapa (MUN_NAME pré-calculado por scripts/07_tag_muni.py)
+    if "MUN_NAME" in inter_map.columns:
+        inter_muni = inter_map[inter_map["MUN_NAME"].isin(mun_sel)]
+    elif not inter_map.empty:
+        st.warning("GeoParquet sem coluna MUN_NAME (regravado depois do 07?). Rode: python scripts/07_tag_muni.py")
+    inter_safe_filtered = inter_muni
 else:
     # mantém o que já tínhamos (sem filtro por município)
-    inter_safe_filtered = inter_map.copy()
+    inter_safe_filtered = inter_map   # só leitura daqui em diante: sem cópia
 
 # Atualiza o inter_safe usado no mapa
-inter_safe = sanitize_for_folium(inter_safe_filtered.to_crs(WGS84)) if not inter_safe_filtered.empty else inter_safe_filtered
+inter_safe = sanitize_for_folium(inter_safe_filtered) if not inter_safe_filtered.empty else inter_safe_filtered
 
 
 # --- indicadores (3 cards lado a lado) ---
@@ -316,7 +528,19 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-n_feats = int(len(inter_safe))
+# contagem no DuckDB (view sem geometria criada por scripts/06_build_duckdb.py)
+if duck_has_table("inter_nogeom"):
+    n_sql = """
+        SELECT COUNT(*) AS n FROM inter_nogeom
+        WHERE year BETWEEN ? AND ? AND list_contains(?::VARCHAR[], CAST(ring_id AS VARCHAR))
+    """
+    n_params = [ymin, ymax, rings_sel]
+    if using_muni_filter:
+        n_sql += " AND list_contains(?::VARCHAR[], MUN_NAME)"
+        n_params.append(mun_sel)
+    n_feats = int(duck_query(n_sql, n_params)["n"].iloc[0])
+else:
+    n_feats = int(len(inter_safe))
 total_ha = float(by_ring["area_ha"].sum()) if not by_ring.empty else 0.0
 
 st.markdown(
@@ -349,12 +573,12 @@ by_ring_year_disp = by_ring_year.rename(columns=label_map)
 if "Faixa de distância" in by_ring_disp.columns:
     by_ring_disp["Faixa de distância"] = pd.Categorical(by_ring_disp["Faixa de distância"], ORDER_RINGS, ordered=True)
     by_ring_disp = by_ring_disp.sort_values("Faixa de distância")
-    by_ring_disp["Área (ha)"] = by_ring_disp["Área (ha)"].apply(fmt_float2_br)
+    by_ring_disp["Área (ha)"] = fmt_float2_br_series(by_ring_disp["Área (ha)"])
 
 if {"Faixa de distância","Ano"}.issubset(by_ring_year_disp.columns):
     by_ring_year_disp["Faixa de distância"] = pd.Categorical(by_ring_year_disp["Faixa de distância"], ORDER_RINGS, ordered=True)
     by_ring_year_disp = by_ring_year_disp.sort_values(["Ano","Faixa de distância"])
-    by_ring_year_disp["Área (ha)"] = by_ring_year_disp["Área (ha)"].apply(fmt_float2_br)
+    by_ring_year_disp["Área (ha)"] = fmt_float2_br_series(by_ring_year_disp["Área (ha)"])
 
 st.markdown("### Área por faixa (ha)")
 if by_ring_disp.empty:
@@ -388,11 +612,32 @@ def _cfg(c):
          .configure_legend(labelFontSize=12, titleFontSize=13)
          .configure_view(strokeOpacity=0)
     )
+
+def chart_agg(cols: dict[str, str]) -> pa.Table:
+    """
+    Agregado p/ gráfico direto do DuckDB em Arrow (Altair lê Arrow), mesmos filtros das tabelas.
+    `cols`: coluna no banco -> título no gráfico; a área vira "Área (ha)".
+    """
+    if using_muni_filter:
+        src, extra, params = "by_muni_ring_year", " AND list_contains(?::VARCHAR[], MUN_NAME)", [ymin, ymax, rings_sel, mun_sel]
+    else:
+        src, extra, params = "by_ring_year", "", [ymin, ymax, rings_sel]
+    select = ", ".join(f'{c} AS "{t}"' for c, t in cols.items())
+    group = ", ".join(cols)
+    return duck_query(f"""
+        SELECT {select}, SUM(area_ha) AS "Área (ha)"
+        FROM {src}
+        WHERE year BETWEEN ? AND ?
+          AND list_contains(?::VARCHAR[], CAST(ring_id AS VARCHAR)){extra}
+        GROUP BY {group}
+        ORDER BY {group};
+    """, params, arrow=True)
+
 # ---------------- Área por faixa (barras) ----------------
 st.markdown("### Área por faixa (gráfico)")
 if not by_ring.empty:
-    _ring_plot = by_ring.rename(columns={"ring_id":"Faixa de distância","area_ha":"Área (ha)"}).copy()
-    _ring_plot["Faixa de distância"] = pd.Categorical(_ring_plot["Faixa de distância"], ORDER_RINGS, ordered=True)
+    # ordem das faixas vem do sort/domain do Altair (sem Categorical nem cópia)
+    _ring_plot = chart_agg({"ring_id": "Faixa de distância"})
     chart_bar = (
         alt.Chart(_ring_plot, height=320)
         .mark_bar()
@@ -411,10 +656,7 @@ else:
 # ---------------- Série total por ano ----------------
 st.markdown("### Série temporal — total por ano (todas as faixas)")
 if not by_ring_year.empty:
-    series_total = (
-        by_ring_year.groupby("year", as_index=False)["area_ha"].sum()
-                    .rename(columns={"year":"Ano","area_ha":"Área (ha)"})
-    )
+    series_total = chart_agg({"year": "Ano"})
     chart_line_total = (
         alt.Chart(series_total, height=380)
         .mark_line(point=True)
@@ -432,8 +674,7 @@ else:
 # ---------------- Facetas por faixa (2x2, grandes) ----------------
 st.markdown("### Série temporal por faixa (facetas)")
 if not by_ring_year.empty:
-    _byry = by_ring_year.rename(columns={"ring_id":"Faixa de distância","year":"Ano","area_ha":"Área (ha)"}).copy()
-    _byry["Faixa de distância"] = pd.Categorical(_byry["Faixa de distância"], ORDER_RINGS, ordered=True)
+    _byry = chart_agg({"ring_id": "Faixa de distância", "year": "Ano"})
     facet_chart = (
         alt.Chart(_byry)
         .mark_line(point=True)
@@ -460,153 +701,183 @@ else:
 # -----------------------
 # Mapa (robusto, com basemap único ativo e vetores leves)
 # -----------------------
-st.markdown("### Mapa interativo")
-b = aoi.total_bounds
-center = [(b[1] + b[3]) / 2, (b[0] + b[2]) / 2]
-
 # limite seguro para ligar a camada pesada automaticamente
 MAX_FEATURES_AUTO_SHOW = 6000
-force_full = st.toggle("Forçar renderização completa da interseção no mapa (pode ficar pesado)", value=False)
-
-# Folium/Leaflet otimizações
-m = folium.Map(
-    location=center,
-    zoom_start=6,
-    control_scale=True,
-    tiles=None,              # vamos controlar quais tiles ficam ativos
-    prefer_canvas=True       # desenha vetores em canvas, MUITO mais leve
-)
 
-# ---- Basemaps (apenas UM ativo por padrão) ----
-folium.TileLayer("OpenStreetMap", name="OpenStreetMap", show=True).add_to(m)
-folium.TileLayer("CartoDB positron", name="cartodbpositron", show=False).add_to(m)
-folium.TileLayer("CartoDB Voyager", name="CartoDB Voyager", show=False).add_to(m)
-folium.TileLayer(
-    tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Street_Map/MapServer/tile/{z}/{x}/{y}",
-    attr="Tiles © Esri — Source: Esri, HERE, Garmin, FAO, NOAA, USGS | © OpenStreetMap contributors",
-    name="Esri Streets",
-    show=False
-).add_to(m)
-folium.TileLayer(
-    tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{x}/{y}",
-    attr="Tiles © Esri — World Imagery",
-    name="Esri Imagery (satélite)",
-    show=False
-).add_to(m)
-
-# ---- AOI ----
-folium.GeoJson(
-    aoi.__geo_interface__, name="Roraima",
-    style_function=lambda x: {"color": "#222", "fill": False, "weight": 2},
-    smooth_factor=1.2
-).add_to(m)
-
-# ---- Destaque dos municípios selecionados ----
-if using_muni_filter:
-    folium.GeoJson(
-        municipios[municipios["MUN_NAME"].isin(mun_sel)].__geo_interface__,
-        name="Município(s) selecionado(s)",
-        style_function=lambda x: {"color":"#ff9800", "weight": 2, "fill": False, "dashArray": "6,4"},
-        tooltip=folium.GeoJsonTooltip(fields=["MUN_NAME"], aliases=["Município"])
+# ---- Mapa base (tiles, AOI, municípios, anéis, rodovias) ----
+# o folium.Map é montado de novo a cada rerun (barato): o caro — ler, simplificar e serializar as
+# camadas — já vem em cache nas strings GeoJSON (aoi_geojson, rings_geojson, …). Cachear o Map
+# obrigaria a clonar o objeto inteiro, com todas as camadas, a cada execução.
+def base_map(center: tuple[float, float], rings_key: tuple[str, ...], muni_key: tuple[str, ...],
+             roads_tol: float) -> tuple[folium.Map, str | None]:
+    """Mapa sem a camada de interseção + mensagem de erro das rodovias (ou None)."""
+    # Folium/Leaflet otimizações
+    m = folium.Map(
+        location=list(center),
+        zoom_start=6,
+        control_scale=True,
+        tiles=None,              # vamos controlar quais tiles ficam ativos
+        prefer_canvas=True       # desenha vetores em canvas, MUITO mais leve
+    )
+
+    # ---- Basemaps (apenas UM ativo por padrão) ----
+    folium.TileLayer("OpenStreetMap", name="OpenStreetMap", show=True).add_to(m)
+    folium.TileLayer("CartoDB positron", name="cartodbpositron", show=False).add_to(m)
+    folium.TileLayer("CartoDB Voyager", name="CartoDB Voyager", show=False).add_to(m)
+    folium.TileLayer(
+        tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Street_Map/MapServer/tile/{z}/{x}/{y}",
+        attr="Tiles © Esri — Source: Esri, HERE, Garmin, FAO, NOAA, USGS | © OpenStreetMap contributors",
+        name="Esri Streets",
+        show=False
+    ).add_to(m)
+    folium.TileLayer(
+        tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{x}/{y}",
+        attr="Tiles © Esri — World Imagery",
+        name="Esri Imagery (satélite)",
+        show=False
     ).add_to(m)
 
-# ---- ANÉIS com cores fixas ----
-rings_plot = rings[rings["ring_id"].astype(str).isin(rings_sel)].copy()
-def _ring_style(feat):
-    rid = feat["properties"].get("ring_id")
-    color = RING_COLORS.get(rid, "#2b8cbe")
-    return {"color": color, "fillColor": color, "fillOpacity": 0.20, "weight": 1}
-
-folium.GeoJson(
-    rings_plot.__geo_interface__, name="Faixas (anéis)",
-    style_function=_ring_style,
-    tooltip=folium.GeoJsonTooltip(fields=["ring_id"], aliases=["Faixa"]),
-    smooth_factor=1.2
-).add_to(m)
-
-# ---- RODOVIAS (OSM) — BR/ref e name no tooltip ----
-try:
-    roads_path = PROC / "roads_rr.shp"
-    roads_wgs = gpd.read_file(roads_path).to_crs(WGS84)
-    # filtra classes principais para não sobrecarregar
-    if "fclass" in roads_wgs.columns:
-        roads_wgs = roads_wgs[roads_wgs["fclass"].isin(["motorway", "trunk", "primary", "secondary"])].copy()
-    # simplifica SÓ para exibir
-    roads_wgs["geometry"] = roads_wgs.geometry.simplify(0.00010, preserve_topology=True)
+    # ---- AOI ----
+    folium.GeoJson(
+        aoi_geojson(AOI_PATH), name="Roraima",
+        style_function=lambda x: {"color": "#222", "fill": False, "weight": 2},
+        smooth_factor=1.2
+    ).add_to(m)
 
-    fields, aliases = [], []
-    for field, alias in [("ref", "BR/Ref"), ("name", "Nome")]:
-        if field in roads_wgs.columns:
-            fields.append(field); aliases.append(alias)
+    # ---- Destaque dos municípios selecionados ----
+    if muni_key:
+        folium.GeoJson(
+            municipios_geojson(MUN_PATH, muni_key),
+            name="Município(s) selecionado(s)",
+            style_function=lambda x: {"color":"#ff9800", "weight": 2, "fill": False, "dashArray": "6,4"},
+            tooltip=folium.GeoJsonTooltip(fields=["MUN_NAME"], aliases=["Município"])
+        ).add_to(m)
+
+    # ---- ANÉIS com cores fixas ----
+    def _ring_style(feat):
+        rid = feat["properties"].get("ring_id")
+        color = RING_COLORS.get(rid, "#2b8cbe")
+        return {"color": color, "fillColor": color, "fillOpacity": 0.20, "weight": 1}
 
     folium.GeoJson(
-        data=roads_wgs.__geo_interface__,
-        name="Rodovias (OSM)",
-        style_function=lambda x: {"color": "#444", "weight": 1.5, "opacity": 0.9},
-        tooltip=folium.GeoJsonTooltip(fields=fields, aliases=aliases, sticky=False),
+        rings_geojson(RINGS_PATH, rings_key), name="Faixas (anéis)",
+        style_function=_ring_style,
+        tooltip=folium.GeoJsonTooltip(fields=["ring_id"], aliases=["Faixa"]),
         smooth_factor=1.2
     ).add_to(m)
-except Exception as e:
-    st.warning(f"Não foi possível carregar 'roads_rr.shp' para rótulos de BRs: {e}")
+
+    # ---- RODOVIAS (OSM) — BR/ref e name no tooltip ----
+    roads_error = None
+    try:
+        roads_json, fields, aliases = roads_geojson(PROC / "roads_rr.parquet", roads_tol)
+        folium.GeoJson(
+            data=roads_json,
+            name="Rodovias (OSM)",
+            style_function=lambda x: {"color": "#444", "weight": 1.5, "opacity": 0.9},
+            tooltip=folium.GeoJsonTooltip(fields=fields, aliases=aliases, sticky=False),
+            smooth_factor=1.2
+        ).add_to(m)
+    except Exception as e:
+        roads_error = str(e)
+    return m, roads_error
 
 # ---- Interseção PRODES × anéis (camada pesada) ----
-if not inter_safe.empty:
-    inter_draw = inter_safe.copy()
-    # simplifica só para o mapa; ajusta o valor se quiser mais/menos detalhe
-    inter_draw["geometry"] = inter_draw.geometry.simplify(0.00020, preserve_topology=True)
-    if "area_ha" in inter_draw.columns:
-        inter_draw["area_ha_fmt"] = inter_draw["area_ha"].apply(fmt_float2_br)
-
-    fields = []; aliases = []
-    if "ring_id" in inter_draw.columns: fields.append("ring_id"); aliases.append("Faixa")
-    if "year" in inter_draw.columns:    fields.append("year");    aliases.append("Ano")
-    if "area_ha_fmt" in inter_draw.columns: fields.append("area_ha_fmt"); aliases.append("Área (ha)")
-
-    # liga automaticamente só se for “leve”; caso contrário, deixa desligado (show=False)
-    auto_show = (len(inter_draw) <= MAX_FEATURES_AUTO_SHOW) or force_full
-    if not auto_show:
-        st.info(f"Muitos polígonos para o navegador ({len(inter_draw):,}): deixei a camada **desligada** por padrão. "
-                f"Se quiser ver, marque **Forçar renderização completa** acima."
-               .replace(",", "."))
+# cache_resource: o dict GeoJSON é reaproveitado sem cópia enquanto os filtros não mudam; poucas
+# entradas — cada uma é a camada inteira em objetos Python (o recorte atual e o anterior bastam)
+@st.cache_resource(show_spinner=False, max_entries=2)
+def inter_layer_geojson(_inter_safe: gpd.GeoDataFrame, filters_key: tuple) -> tuple[dict, list, list]:
+    """
+    GeoJSON (dict) da camada de interseção; `filters_key` identifica o recorte (mtime do
+    GeoParquet, anos, anéis, municípios).
+    """
+    geoms = _inter_safe.geometry
+    if not parquet_has_column(PARQUET_PATH, PARQUET_MTIME, "geom_map"):
+        # GeoParquet antigo (sem geom_map): simplifica só para o mapa
+        geoms = geoms.simplify(0.00020, preserve_topology=True)
+
+    # monta só as propriedades do tooltip (sem copiar o GeoDataFrame inteiro)
+    props = {}; fields = []; aliases = []
+    if "ring_id" in _inter_safe.columns:
+        props["ring_id"] = _inter_safe["ring_id"]; fields.append("ring_id"); aliases.append("Faixa")
+    if "year" in _inter_safe.columns:
+        props["year"] = _inter_safe["year"]; fields.append("year"); aliases.append("Ano")
+    if "area_ha" in _inter_safe.columns:
+        props["area_ha_fmt"] = fmt_float2_br_series(_inter_safe["area_ha"]); fields.append("area_ha_fmt"); aliases.append("Área (ha)")
+    inter_draw = gpd.GeoDataFrame(props, geometry=geoms, crs=_inter_safe.crs)
+
+    # só as propriedades do tooltip vão para o navegador
+    return to_map_precision(inter_draw).__geo_interface__, fields, aliases
+
+@st.fragment
+def map_section():
+    # fragmento: o toggle e as interações com o mapa (zoom/arrasto) reexecutam só este trecho
+    st.markdown("### Mapa interativo")
+    b = aoi.total_bounds
+    center = [(b[1] + b[3]) / 2, (b[0] + b[2]) / 2]
+
+    force_full = st.toggle("Forçar renderização completa da interseção no mapa (pode ficar pesado)", value=False)
+
+    m, roads_error = base_map(
+        tuple(center), tuple(sorted(rings_sel)),
+        tuple(sorted(mun_sel)) if using_muni_filter else (), ROADS_SIMPLIFY_DEG,
+    )
+    if roads_error:
+        st.warning(f"Não foi possível carregar 'roads_rr.parquet' para rótulos de BRs: {roads_error}")
+
+    if USE_PMTILES:
+        # tiles vetoriais: o navegador só baixa o que está na tela (sem tooltip por feição)
+        PMTilesLayer(PMTILES_URL, ymin, ymax, rings_sel, mun_sel if using_muni_filter else []).add_to(m)
+    elif not inter_safe.empty:
+        inter_geo, fields, aliases = inter_layer_geojson(
+            inter_safe, (PARQUET_MTIME, ymin, ymax, tuple(rings_sel), tuple(mun_sel) if using_muni_filter else ())
+        )
+        n_draw = len(inter_geo["features"])
+
+        # liga automaticamente só se for “leve”; caso contrário, deixa desligado (show=False)
+        auto_show = (n_draw <= MAX_FEATURES_AUTO_SHOW) or force_full
+        if not auto_show:
+            st.info(f"Muitos polígonos para o navegador ({n_draw:,}): deixei a camada **desligada** por padrão. "
+                    f"Se quiser ver, marque **Forçar renderização completa** acima."
+                   .replace(",", "."))
+
+        folium.GeoJson(
+            data=inter_geo,
+            name=f"Interseção PRODES × anéis (n={n_draw})",
+            style_function=lambda x: {"color": "#e31a1c", "fillColor": "#fb9a99", "fillOpacity": 0.35, "weight": 0.5},
+            tooltip=folium.GeoJsonTooltip(fields=fields, aliases=aliases),
+            smooth_factor=1.0,
+            show=auto_show
+        ).add_to(m)
+    else:
+        folium.map.Marker(location=center, tooltip="Sem polígonos para os filtros.").add_to(m)
 
-    folium.GeoJson(
-        data=inter_draw.to_json(),
-        name=f"Interseção PRODES × anéis (n={len(inter_draw)})",
-        style_function=lambda x: {"color": "#e31a1c", "fillColor": "#fb9a99", "fillOpacity": 0.35, "weight": 0.5},
-        tooltip=folium.GeoJsonTooltip(fields=fields, aliases=aliases),
-        smooth_factor=1.0,
-        show=auto_show
-    ).add_to(m)
-else:
-    folium.map.Marker(location=center, tooltip="Sem polígonos para os filtros.").add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    st_folium(m, height=650, use_container_width=True)
 
-folium.LayerControl(collapsed=False).add_to(m)
-st_folium(m, height=650, use_container_width=True)
+map_section()
 
 # ==========================
 # Detalhe por município
 # ==========================
-if using_muni_filter and not inter_muni.empty:
+if using_muni_filter and not by_ring.empty:
     st.markdown("## Detalhe por município")
 
-    # --- agregados ---
+    # --- agregados (DuckDB) ---
     muni_total = (
-        inter_muni.groupby("MUN_NAME", as_index=False)["area_ha"].sum()
-        .sort_values("area_ha", ascending=False)
+        muni_agg(["MUN_NAME"], "area_ha DESC")
         .rename(columns={"MUN_NAME": "Município", "area_ha": "Área (ha)"})
     )
     muni_ring = (
-        inter_muni.groupby(["MUN_NAME", "ring_id"], as_index=False)["area_ha"].sum()
+        muni_agg(["MUN_NAME", "ring_id"], "MUN_NAME, ring_id")
         .rename(columns={"MUN_NAME": "Município", "ring_id": "Faixa", "area_ha": "Área (ha)"})
     )
     muni_year_ring = (
-        inter_muni.groupby(["MUN_NAME", "year", "ring_id"], as_index=False)["area_ha"].sum()
+        muni_agg(["MUN_NAME", "year", "ring_id"], "MUN_NAME, year, ring_id")
         .rename(columns={"MUN_NAME": "Município", "year": "Ano", "ring_id": "Faixa", "area_ha": "Área (ha)"})
     )
 
     # formata números na tabela total
-    muni_total_fmt = muni_total.copy()
-    muni_total_fmt["Área (ha)"] = muni_total_fmt["Área (ha)"].apply(fmt_float2_br)
+    muni_total_fmt = muni_total.assign(**{"Área (ha)": fmt_float2_br_series(muni_total["Área (ha)"])})
 
     c1, c2 = st.columns([1, 2])
     with c1:
@@ -642,10 +913,8 @@ if using_muni_filter and not inter_muni.empty:
 
     with c2:
         st.markdown("**Barras por município × faixa (empilhado)**")
-        _bar = muni_ring.copy()
-        _bar["Faixa"] = pd.Categorical(_bar["Faixa"], ORDER_RINGS, ordered=True)
         chart_muni_bar = (
-            alt.Chart(_bar, height=320)
+            alt.Chart(muni_ring, height=320)
             .mark_bar()
             .encode(
                 x=alt.X("Município:N", sort=muni_total["Município"].tolist()),
@@ -666,12 +935,9 @@ if using_muni_filter and not inter_muni.empty:
         )
 
     st.markdown("**Série temporal por município (facetas)**")
-    _ts = muni_year_ring.copy()
-    _ts["Faixa"] = pd.Categorical(_ts["Faixa"], ORDER_RINGS, ordered=True)
-
     ncols = 2 if len(mun_sel) > 1 else 1
     chart_ts = (
-        alt.Chart(_ts)
+        alt.Chart(muni_year_ring)
         .mark_line(point=True)
         .encode(
             x=alt.X("Ano:O"),
@@ -4,11 +4,9 @@
 doc.py — Gera um PDF com análises do desmatamento (PRODES) por distância de estradas em Roraima.
 
 Entradas esperadas (projeto):
-- data/processed/intersection/intersections.duckdb            # agregados globais (by_ring_year)
-- data/processed/intersection/inter_prodes_rings.parquet      # geometrias (GeoParquet) PRODES ∩ anéis
-- data/processed/buffers/buffer_rings.shp                     # anéis (opcional, só p/ extents)
-- data/processed/roraima_aoi.geojson                          # AOI (opcional)
-- data/external/ibge_municipal/RR_Municipios_2024.shp         # municípios IBGE
+- data/processed/intersection/intersections.duckdb            # agregados globais (by_ring_year) e
+                                                               # municipais (by_muni_ring_year, de scripts/07_tag_muni.py)
+Nenhuma geometria é lida aqui: a atribuição a municípios acontece uma vez, em 07_tag_muni.py.
 
 Saída (padrão):
 - reports/relatorio_roraima.pdf
@@ -20,11 +18,15 @@ import io
 import sys
 import math
 import datetime as dt
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache, wraps
 
 import duckdb
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely.validation import make_valid
 
 # ReportLab
 from reportlab.lib.pagesizes import A4
@@ -32,11 +34,17 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.lib.units import cm
+from reportlab.graphics.shapes import Drawing, Group, String
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.graphics.widgets.markers import makeMarker
 
 # Matplotlib (gráficos)
-import matplotlib
-matplotlib.use("Agg")  # backend headless
-import matplotlib.pyplot as plt
+# Figure + FigureCanvasAgg direto (sem pyplot): sem estado global, então dá p/ renderizar em threads
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 
 # Tamanhos padrão p/ imagens no PDF (caber no frame)
 PAGE_IMG_W = 16*cm      # ~ largura útil
@@ -53,11 +61,6 @@ PROC = DATA / "processed"
 INTER_DIR = PROC / "intersection"
 
 DB_PATH = INTER_DIR / "intersections.duckdb"
-PARQUET_PATH = INTER_DIR / "inter_prodes_rings.parquet"
-MUN_PATH = DATA / "external" / "ibge_municipal" / "RR_Municipios_2024.shp"
-
-WGS84 = "EPSG:4326"
-EQUAL_AREA = "EPSG:5880"
 
 ORDER_RINGS = ["0-5km", "5-10km", "10-20km", ">20km"]
 RING_COLORS = {
@@ -82,84 +85,202 @@ def fmt_float2_br(x) -> str:
     except Exception:
         return str(x)
 
+def fmt_float2_br_series(s: pd.Series) -> pd.Series:
+    """fmt_float2_br vetorizado (operações de string do pandas, sem função Python por linha)."""
+    v = pd.to_numeric(s, errors="coerce").astype(float)
+    ok = np.isfinite(v)   # NaN/±inf caem no astype(str) abaixo, como no fmt_float2_br escalar
+    cents = (v[ok].abs() * 100).round().astype("int64")
+    inteiro = (cents // 100).astype(str).str.replace(r"(\d)(?=(\d{3})+$)", r"\1.", regex=True)
+    frac = (cents % 100).astype(str).str.zfill(2)
+    sinal = pd.Series(np.where(v[ok] < 0, "-", ""), index=cents.index)
+    out = s.astype(str)
+    out[ok] = sinal + inteiro + "," + frac
+    return out
+
 def ensure_dir(p: Path):
     p.mkdir(parents=True, exist_ok=True)
 
+@lru_cache(maxsize=1)
+def _con() -> duckdb.DuckDBPyConnection:
+    """Conexão só leitura aberta uma vez por processo (sem reabrir arquivo/catálogo a cada consulta)."""
+    return duckdb.connect(DB_PATH.as_posix(), read_only=True)
+
 def read_duck(sql: str, params=None) -> pd.DataFrame:
-    con = duckdb.connect(DB_PATH.as_posix(), read_only=True)
+    # cursor próprio por chamada: o PDF do app é gerado numa thread separada
+    cur = _con().cursor()
     try:
-        df = con.execute(sql, params or {}).fetchdf()
+        # resultado columnar via Arrow; split_blocks + self_destruct: cada coluna vira seu próprio
+        # bloco numpy sem consolidar (nem manter a tabela Arrow viva em paralelo)
+        return cur.execute(sql, params or {}).fetch_arrow_table().to_pandas(split_blocks=True, self_destruct=True)
     finally:
-        con.close()
-    return df
-
-def load_municipios(path: Path) -> gpd.GeoDataFrame:
-    if not path.exists():
-        raise FileNotFoundError(f"Shapefile de municípios não encontrado: {path}")
-    gdf = gpd.read_file(path)
-    if gdf.crs is None:
-        gdf = gdf.set_crs(WGS84)
-    gdf = gdf.to_crs(WGS84)
-    # detectar coluna de nome
-    candidates = ["NM_MUN", "NM_MUNICIP", "NM_MUNICIPIO", "NOME_MUN", "NM_MUN_2024", "name"]
-    name_col = next((c for c in candidates if c in gdf.columns), None)
-    if name_col is None:
-        gdf["MUN_NAME"] = gdf.index.astype(str)
-        name_col = "MUN_NAME"
-    gdf = gdf.rename(columns={name_col: "MUN_NAME"})
-    gdf["MUN_NAME"] = gdf["MUN_NAME"].astype(str)
-    return gdf[["MUN_NAME", "geometry"]]
-
-def load_intersection_gpq(path: Path) -> gpd.GeoDataFrame:
-    if not path.exists():
-        raise FileNotFoundError(f"GeoParquet não encontrado: {path}")
-    gdf = gpd.read_parquet(path)
-    if gdf.crs is None:
-        # GeoParquet correto carrega CRS, mas garantimos
-        gdf = gdf.set_crs(EQUAL_AREA)
-    return gdf
-
-def draw_png(fig, width_px=1200, dpi=150):
+        cur.close()
+
+def duck_has_table(name: str) -> bool:
+    df = read_duck("SELECT 1 FROM information_schema.tables WHERE table_name = ?;", [name])
+    return not df.empty
+
+# município / município×faixa / município×ano×faixa numa única passada (GROUPING SETS)
+ROLLUP_SQL = """
+    SELECT MUN_NAME, ring_id, CAST(year AS SMALLINT) AS year, SUM(area_ha) AS area_ha,
+           GROUPING(ring_id) AS g_r, GROUPING(year) AS g_y
+    FROM by_muni_ring_year
+    WHERE year BETWEEN ? AND ?{extra}
+    GROUP BY GROUPING SETS ((MUN_NAME), (MUN_NAME, ring_id), (MUN_NAME, year, ring_id));
+"""
+
+def _split_rollup(df: pd.DataFrame):
+    """Separa o resultado do ROLLUP_SQL em (muni_total, muni_ring, muni_year_ring)."""
+    muni_total = (df.loc[(df["g_r"] == 1) & (df["g_y"] == 1), ["MUN_NAME", "area_ha"]]
+                  .sort_values("area_ha", ascending=False, ignore_index=True))
+    muni_ring = (df.loc[(df["g_r"] == 0) & (df["g_y"] == 1), ["MUN_NAME", "ring_id", "area_ha"]]
+                 .sort_values(["MUN_NAME", "ring_id"], ignore_index=True))
+    # maior dos três: chaves em category (códigos inteiros) e ano em int16 p/ os groupby/filtros seguintes
+    muni_year_ring = (df.loc[(df["g_r"] == 0) & (df["g_y"] == 0), ["MUN_NAME", "year", "ring_id", "area_ha"]]
+                      .astype({"year": "int16", "MUN_NAME": "category", "ring_id": "category"})
+                      .sort_values(["MUN_NAME", "year", "ring_id"], ignore_index=True))
+    return muni_total, muni_ring, muni_year_ring
+
+def muni_aggregates(y_min: int, y_max: int, municipios_filtro: list[str] | None):
+    """
+    Agregados municipais do recorte: (muni_total, muni_ring, muni_year_ring).
+    Lidos da tabela materializada by_muni_ring_year (scripts/07_tag_muni.py) — só scan + filtro,
+    a mesma base do app (município pelo ponto representativo de cada feição).
+    """
+    extra, params = "", [y_min, y_max]
+    if municipios_filtro:
+        extra = " AND list_contains(?::VARCHAR[], MUN_NAME)"
+        params.append(list(municipios_filtro))
+    return _split_rollup(read_duck(ROLLUP_SQL.format(extra=extra), params))
+
+def new_figure(*args, figsize=None, **kw):
+    """Equivalente a plt.subplots(), mas fora do registro global do pyplot (thread-safe)."""
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots(*args, **kw)
+
+# PNG na resolução em que aparece no PDF (16 cm ≈ 630 px a 100 dpi): menos pixels p/ o libpng
+# codificar e PDF menor
+PNG_DPI = 100
+PNG_WIDTH_PX = 640
+PNG_WIDTH_PX_TALL = 700   # facetas (quadro de 18 cm de altura)
+
+def draw_png(fig, width_px=PNG_WIDTH_PX, dpi=PNG_DPI) -> bytes:
     buf = io.BytesIO()
     fig.set_size_inches(width_px/dpi, (width_px/dpi)*0.56)  # 16:9 approx
-    fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight")
-    plt.close(fig)
-    buf.seek(0)
-    return buf
+    # layout "tight" no próprio figure: bbox_inches="tight" faria o savefig renderizar 2x
+    fig.set_layout_engine("tight")
+    fig.savefig(buf, format="png", dpi=dpi)
+    return buf.getvalue()
+
+# PNGs já renderizados, por (gráfico, conteúdo dos dados, args): mesmos agregados -> mesmos bytes
+_PNG_CACHE: dict[tuple, bytes] = {}
+_PNG_CACHE_MAX = 64
+_PNG_LOCK = threading.Lock()   # plots rodam em threads (build_pdf_bytes e jobs de PDF do app em paralelo)
+
+def _df_digest(df: pd.DataFrame) -> str:
+    h = hashlib.sha1("|".join(map(str, df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def png_cached(plot_fn):
+    """Memoiza um plot_*(df, ...) -> bytes pelo digest do DataFrame (agregados pequenos: hash barato)."""
+    @wraps(plot_fn)
+    def wrapper(df: pd.DataFrame, *args):
+        key = (plot_fn.__name__, _df_digest(df), repr(args))
+        with _PNG_LOCK:
+            blob = _PNG_CACHE.get(key)
+        if blob is None:
+            blob = plot_fn(df, *args)   # desenho fora do lock: gráficos diferentes seguem em paralelo
+            with _PNG_LOCK:
+                _PNG_CACHE[key] = blob
+                while len(_PNG_CACHE) > _PNG_CACHE_MAX:
+                    _PNG_CACHE.pop(next(iter(_PNG_CACHE)), None)
+        return blob
+    return wrapper
 
 # ----------------------------
 # Gráficos
 # ----------------------------
-def plot_total_by_year(df_yr: pd.DataFrame) -> io.BytesIO:
+# gráficos simples (linha/barras): desenhados direto em primitivas do ReportLab (vetor no PDF,
+# sem matplotlib/libpng); os facetados/empilhados continuam em matplotlib (PNG)
+CHART_FONT = "Helvetica"
+
+def _chart_frame(title: str) -> Drawing:
+    d = Drawing(PAGE_IMG_W, PAGE_IMG_H)
+    d.add(String(d.width/2, d.height-14, title, fontName="Helvetica-Bold", fontSize=11, textAnchor="middle"))
+    return d
+
+def _axis_labels(d: Drawing, x0: float, y0: float, w: float, h: float, xlabel: str, ylabel: str):
+    d.add(String(x0 + w/2, 4, xlabel, fontName=CHART_FONT, fontSize=9, textAnchor="middle"))
+    ylab = Group(String(0, 0, ylabel, fontName=CHART_FONT, fontSize=9, textAnchor="middle"))
+    ylab.transform = (0, 1, -1, 0, 10, y0 + h/2)   # rotação de 90° (texto vertical)
+    d.add(ylab)
+
+def _value_axis_style(axis):
+    axis.valueMin = 0
+    axis.labelTextFormat = fmt_int_br
+    axis.labels.fontName = CHART_FONT
+    axis.labels.fontSize = 8
+    axis.visibleGrid = True
+    axis.gridStrokeColor = colors.HexColor("#D1D5DB")
+    axis.gridStrokeWidth = 0.25
+
+def plot_total_by_year(df_yr: pd.DataFrame) -> Drawing:
     """df_yr: columns ['year','area_ha']"""
-    fig, ax = plt.subplots()
-    ax.plot(df_yr["year"], df_yr["area_ha"], marker="o")
-    ax.set_xlabel("Ano")
-    ax.set_ylabel("Área (ha)")
-    ax.grid(True, alpha=.3)
-    ax.set_title("Área total desmatada por ano (todas as faixas)")
-    return draw_png(fig)
-
-def plot_ring_bar(df_ring: pd.DataFrame) -> io.BytesIO:
+    d = _chart_frame("Área total desmatada por ano (todas as faixas)")
+    x0, y0 = 62, 34
+    w, h = d.width - x0 - 14, d.height - y0 - 26
+    pts = list(zip(df_yr["year"].astype(int).tolist(), df_yr["area_ha"].astype(float).tolist()))
+    if not pts:
+        d.add(String(d.width/2, d.height/2, "Sem dados", fontName=CHART_FONT, fontSize=10, textAnchor="middle"))
+        return d
+    lp = LinePlot()
+    lp.x, lp.y, lp.width, lp.height = x0, y0, w, h
+    lp.data = [pts]
+    lp.lines[0].strokeColor = colors.HexColor("#1f77b4")
+    lp.lines[0].strokeWidth = 1.5
+    lp.lines[0].symbol = makeMarker("FilledCircle", size=4)
+    years = [p[0] for p in pts]
+    lp.xValueAxis.valueMin, lp.xValueAxis.valueMax = min(years) - 0.5, max(years) + 0.5
+    lp.xValueAxis.valueSteps = years
+    lp.xValueAxis.labelTextFormat = "%d"
+    lp.xValueAxis.labels.fontName = CHART_FONT
+    lp.xValueAxis.labels.fontSize = 8
+    _value_axis_style(lp.yValueAxis)
+    d.add(lp)
+    _axis_labels(d, x0, y0, w, h, "Ano", "Área (ha)")
+    return d
+
+def plot_ring_bar(df_ring: pd.DataFrame) -> Drawing:
     """df_ring: ['ring_id','area_ha']"""
     order = ORDER_RINGS
-    colors = [RING_COLORS[r] for r in order]
-    d = df_ring.set_index("ring_id").reindex(order)
-    fig, ax = plt.subplots()
-    ax.bar(d.index, d["area_ha"], color=colors)
-    ax.set_xlabel("Faixa de distância")
-    ax.set_ylabel("Área (ha)")
-    ax.set_title("Área por faixa (acumulado no período)")
-    ax.grid(True, axis="y", alpha=.3)
-    return draw_png(fig)
-
-def plot_muni_ring_stacked(df_mr: pd.DataFrame) -> io.BytesIO:
+    area = dict(zip(df_ring["ring_id"].astype(str), df_ring["area_ha"].astype(float)))
+    vals = [area.get(rid, 0.0) for rid in order]
+    d = _chart_frame("Área por faixa (acumulado no período)")
+    x0, y0 = 62, 34
+    w, h = d.width - x0 - 14, d.height - y0 - 26
+    bc = VerticalBarChart()
+    bc.x, bc.y, bc.width, bc.height = x0, y0, w, h
+    bc.data = [vals]
+    bc.categoryAxis.categoryNames = order
+    bc.categoryAxis.labels.fontName = CHART_FONT
+    bc.categoryAxis.labels.fontSize = 9
+    bc.bars.strokeColor = None
+    for k, rid in enumerate(order):
+        bc.bars[(0, k)].fillColor = colors.HexColor(RING_COLORS[rid])
+    _value_axis_style(bc.valueAxis)
+    d.add(bc)
+    _axis_labels(d, x0, y0, w, h, "Faixa de distância", "Área (ha)")
+    return d
+
+@png_cached
+def plot_muni_ring_stacked(df_mr: pd.DataFrame) -> bytes:
     """
     df_mr: ['MUN_NAME','ring_id','area_ha']
     barras empilhadas por município (x) com faixas como stack
     """
     muni_order = df_mr.groupby("MUN_NAME")["area_ha"].sum().sort_values(ascending=False).index.tolist()
-    fig, ax = plt.subplots()
+    fig, ax = new_figure()
     bottom = None
     for rid in ORDER_RINGS:
         part = (df_mr[df_mr["ring_id"]==rid]
@@ -175,54 +296,82 @@ def plot_muni_ring_stacked(df_mr: pd.DataFrame) -> io.BytesIO:
     ax.legend(title="Faixa")
     return draw_png(fig)
 
-def plot_ts_facets(df_myr: pd.DataFrame, munis: list[str]) -> io.BytesIO:
+@png_cached
+def plot_ts_facets(df_myr: pd.DataFrame, munis: list[str]) -> bytes:
     """
     df_myr: ['MUN_NAME','year','ring_id','area_ha'] — facetas simples: 2 colunas
     Renderizamos como um único gráfico “alto” com subplots por município (linhas), e cores por faixa.
     """
     n = len(munis)
     if n == 0:
-        munis = df_myr["MUN_NAME"].unique().tolist()
+        munis = df_myr["MUN_NAME"].astype(str).unique().tolist()
         n = len(munis)
     rows = n
-    fig, axes = plt.subplots(rows, 1, figsize=(12, max(3.2*rows, 3.2)), sharex=True)
+    w_in = PNG_WIDTH_PX_TALL / PNG_DPI
+    fig, axes = new_figure(rows, 1, figsize=(w_in, max(w_in*0.27*rows, w_in*0.27)), sharex=True)
     if rows == 1:
         axes = [axes]
     for ax, mun in zip(axes, munis):
-        sub = df_myr[df_myr["MUN_NAME"]==mun].copy()
+        # ano × faixa de uma vez; uma LineCollection + um scatter por eixo (em vez de um Line2D por faixa)
+        piv = df_myr[df_myr["MUN_NAME"]==mun].pivot(index="year", columns="ring_id", values="area_ha")
+        x = piv.index.to_numpy(dtype=float)
+        segs, cols = [], []
         for rid in ORDER_RINGS:
-            part = sub[sub["ring_id"]==rid]
-            if part.empty:
+            if rid not in piv.columns:
                 continue
-            ax.plot(part["year"], part["area_ha"], marker="o", label=rid, color=RING_COLORS[rid])
+            y = piv[rid].to_numpy(dtype=float)
+            ok = ~np.isnan(y)   # anos sem registro na faixa: liga os pontos vizinhos, como o ax.plot fazia
+            if ok.any():
+                segs.append(np.column_stack([x[ok], y[ok]]))
+                cols.append(RING_COLORS[rid])
+        if segs:
+            ax.add_collection(LineCollection(segs, colors=cols))
+            pts = np.concatenate(segs)
+            ax.scatter(pts[:, 0], pts[:, 1], c=np.repeat(cols, [len(sg) for sg in segs]), s=36, zorder=3)
+            ax.autoscale_view()
         ax.set_title(mun)
         ax.grid(True, alpha=.3)
         ax.set_ylabel("Área (ha)")
     axes[-1].set_xlabel("Ano")
     # legenda fora
-    handles, labels = axes[0].get_legend_handles_labels()
-    fig.legend(handles, labels, title="Faixa", loc="upper center", ncol=4)
+    handles = [Line2D([], [], color=RING_COLORS[rid], marker="o", label=rid) for rid in ORDER_RINGS]
+    fig.legend(handles=handles, title="Faixa", loc="upper center", ncol=4)
     fig.tight_layout(rect=(0,0,1,0.93))
     buf = io.BytesIO()
-    fig.savefig(buf, format="png", dpi=150, bbox_inches="tight")
-    plt.close(fig)
-    buf.seek(0)
-    return buf
+    fig.savefig(buf, format="png", dpi=PNG_DPI)  # layout já ajustado acima: um só passe de render
+    return buf.getvalue()
 
 # ----------------------------
 # Construção do PDF
 # ----------------------------
-def build_pdf(output_path: Path,
-              years: tuple[int,int] | None,
-              municipios_filtro: list[str] | None):
-
-    # --- checagens
+@dataclass(frozen=True)
+class ReportData:
+    """Tudo o que o relatório usa (agregados pequenos), calculado uma vez por recorte."""
+    y_min: int
+    y_max: int
+    municipios_filtro: tuple[str, ...]
+    by_ring: pd.DataFrame
+    by_year: pd.DataFrame
+    muni_total: pd.DataFrame
+    muni_ring: pd.DataFrame
+    muni_year_ring: pd.DataFrame
+    top_total: pd.DataFrame
+    top_last_year: pd.DataFrame
+
+    @property
+    def last_year(self) -> int:
+        return self.y_max  # último ano disponível do recorte
+
+def prepare_datasets(years: tuple[int,int] | None, municipios_filtro: list[str] | None) -> ReportData:
     if not DB_PATH.exists():
-        print(f"[ERRO] DuckDB não encontrado: {DB_PATH}", file=sys.stderr); sys.exit(2)
-    if not PARQUET_PATH.exists():
-        print(f"[ERRO] GeoParquet não encontrado: {PARQUET_PATH}", file=sys.stderr); sys.exit(2)
+        raise FileNotFoundError(f"DuckDB não encontrado: {DB_PATH}")
+    if not duck_has_table("by_muni_ring_year"):
+        raise FileNotFoundError(f"Tabela by_muni_ring_year ausente em {DB_PATH}\nRode antes: python scripts/07_tag_muni.py")
+    return _prepare(tuple(years) if years else None, tuple(municipios_filtro or ()))
 
-    # --- datasets
+@lru_cache(maxsize=8)
+def _prepare(years: tuple[int,int] | None, munis_key: tuple[str, ...]) -> ReportData:
+    # (cache por recorte: chamadas repetidas do Streamlit com os mesmos filtros não refazem consultas)
     # agregados globais (rápido)
     yrs = read_duck("SELECT MIN(year) AS y0, MAX(year) AS y1 FROM by_ring_year;")
     y0, y1 = int(yrs["y0"].iloc[0]), int(yrs["y1"].iloc[0])
@@ -234,85 +383,96 @@ def build_pdf(output_path: Path,
 
     # agregados por ano/faixa (para resumo/figuras rápidas)
     by_ring_year = read_duck("""
-        SELECT ring_id, year, area_ha
+        SELECT ring_id, CAST(year AS SMALLINT) AS year, area_ha
         FROM by_ring_year
         WHERE year BETWEEN ? AND ?
     """, [y_min, y_max])
+    by_ring_year["ring_id"] = by_ring_year["ring_id"].astype("category")
 
     # total por faixa (período)
-    by_ring = (by_ring_year.groupby("ring_id", as_index=False)["area_ha"].sum()
+    by_ring = (by_ring_year.groupby("ring_id", as_index=False, observed=True)["area_ha"].sum()
                .sort_values("ring_id"))
     # total por ano
     by_year = (by_ring_year.groupby("year", as_index=False)["area_ha"].sum()
                .sort_values("year"))
 
-    # GeoParquet para detalhamento espacial (municipal)
-    inter = load_intersection_gpq(PARQUET_PATH)
-    # normaliza nomes de colunas
-    year_col = next(c for c in inter.columns if c.lower()=="year")
-    inter = inter.rename(columns={year_col: "year"})
-    # filtro por ano
-    inter = inter[(inter["year"]>=y_min) & (inter["year"]<=y_max)].copy()
-    # garante CRS e área em ha correta
-    if inter.crs is None:
-        inter = inter.set_crs(EQUAL_AREA)
-    elif str(inter.crs).lower() != EQUAL_AREA.lower():
-        inter = inter.to_crs(EQUAL_AREA)
-    # recalcula área para garantir
-    inter["area_ha"] = inter.geometry.area / 10_000.0
-
-    # Municípios (WGS84) e reprojeta p/ equal-area para sjoin robusto
-    mun = load_municipios(MUN_PATH)
-    mun = mun.to_crs(EQUAL_AREA)
-
-    # spatial join
-    # (para performance, recorte por bbox geral antes)
-    bbox = mun.union_all().envelope
-    inter_clip = gpd.clip(inter, bbox)
-    inter_muni = gpd.sjoin(
-        inter_clip[["ring_id","year","area_ha","geometry"]],
-        mun[["MUN_NAME","geometry"]],
-        how="inner",
-        predicate="intersects"
-    ).drop(columns=["index_right"])
-
-    # filtro por municípios (opcional)
-    if municipios_filtro:
-        inter_muni = inter_muni[inter_muni["MUN_NAME"].isin(municipios_filtro)].copy()
-
-    # agregados municipais
-    muni_total = (inter_muni.groupby("MUN_NAME", as_index=False)["area_ha"].sum()
-                  .sort_values("area_ha", ascending=False))
-    muni_ring = (inter_muni.groupby(["MUN_NAME","ring_id"], as_index=False)["area_ha"].sum())
-    muni_year_ring = (inter_muni.groupby(["MUN_NAME","year","ring_id"], as_index=False)["area_ha"].sum()
-                      .sort_values(["MUN_NAME","year","ring_id"]))
+    # detalhamento espacial (municipal)
+    muni_total, muni_ring, muni_year_ring = muni_aggregates(y_min, y_max, list(munis_key) or None)
 
     # rankings (Top 10)
-    top_total = muni_total.head(10).copy()
-    # último ano disponível do recorte
-    last_year = y_max
-    top_last_year = (muni_year_ring[muni_year_ring["year"]==last_year]
-                     .groupby("MUN_NAME", as_index=False)["area_ha"].sum()
+    top_total = muni_total.head(10)
+    top_last_year = (muni_year_ring[muni_year_ring["year"]==y_max]
+                     .groupby("MUN_NAME", as_index=False, observed=True)["area_ha"].sum()
                      .sort_values("area_ha", ascending=False).head(10))
 
-    # ---------------- PDF ----------------
-    ensure_dir(output_path.parent)
-    doc = SimpleDocTemplate(
-        output_path.as_posix(),
-        pagesize=A4,
-        leftMargin=1.6*cm, rightMargin=1.6*cm,
-        topMargin=1.2*cm, bottomMargin=1.2*cm
-    )
+    return ReportData(y_min, y_max, munis_key, by_ring, by_year,
+                      muni_total, muni_ring, muni_year_ring, top_total, top_last_year)
+
+def _styles():
     styles = getSampleStyleSheet()
     H1 = ParagraphStyle('H1', parent=styles['Heading1'], fontSize=18, spaceAfter=10)
     H2 = ParagraphStyle('H2', parent=styles['Heading2'], fontSize=14, spaceAfter=8)
     P  = styles['BodyText']
+    return H1, H2, P
 
+def _table(rows: list[list], col_widths: list[float], center_first: bool = True) -> Table:
+    """Tabela com o estilo padrão do relatório (cabeçalho cinza, números à direita)."""
+    t = Table(rows, hAlign="LEFT", colWidths=col_widths)
+    style = [
+        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),
+        ("TEXTCOLOR", (0,0), (-1,0), colors.black),
+        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
+        ("ALIGN", (-1,1), (-1,-1), "RIGHT"),
+        ("INNERGRID", (0,0), (-1,-1), 0.25, colors.HexColor("#D1D5DB")),
+        ("BOX", (0,0), (-1,-1), 0.5, colors.HexColor("#9CA3AF")),
+    ]
+    if center_first:
+        style.append(("ALIGN", (0,0), (0,-1), "CENTER"))
+    t.setStyle(TableStyle(style))
+    return t
+
+def _rank_table(df: pd.DataFrame, value_header: str) -> Table:
+    """Ranking (#, Município, área) a partir de ['MUN_NAME','area_ha'] já ordenado."""
+    area = fmt_float2_br_series(df["area_ha"]).tolist()
+    rows = [["#","Município",value_header]]
+    rows += [[i, mun, a] for i, (mun, a) in enumerate(zip(df["MUN_NAME"].tolist(), area), start=1)]
+    return _table(rows, [1.2*cm, 9*cm, 4*cm])
+
+CHUNK_SIZE = 4   # municípios por página de séries temporais
+
+def _muni_chunks(data: ReportData) -> list[list[str]]:
+    """Municípios das facetas em blocos (para não ficar gigante)."""
+    muni_list = data.muni_total["MUN_NAME"].tolist()
+    if data.municipios_filtro:
+        # respeita ordem do filtro, se vieram poucos
+        muni_list = [m for m in data.municipios_filtro if m in muni_list]
+    return [muni_list[i:i+CHUNK_SIZE] for i in range(0, len(muni_list), CHUNK_SIZE)]
+
+def _render_charts(data: ReportData) -> dict:
+    """
+    Renderiza os gráficos matplotlib (PNG) em paralelo (o savefig passa a maior parte no libpng/zlib,
+    que libera o GIL). Cada plot_* cria o próprio Figure, sem compartilhar estado do pyplot.
+    """
+    top_munis_list = data.muni_total.head(12)["MUN_NAME"].tolist()  # top N p/ caber
+    muni_ring = data.muni_ring
+    muni_year_ring = data.muni_year_ring
+    jobs = {
+        "muni_stack": (plot_muni_ring_stacked, muni_ring[muni_ring["MUN_NAME"].isin(top_munis_list)]),
+    }
+    for i, chunk in enumerate(_muni_chunks(data)):
+        jobs[("ts", i)] = (plot_ts_facets, muni_year_ring[muni_year_ring["MUN_NAME"].isin(chunk)], chunk)
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        futs = {k: ex.submit(fn, *args) for k, (fn, *args) in jobs.items()}
+        return {k: f.result() for k, f in futs.items()}
+
+def _build_story(data: ReportData) -> list:
+    H1, H2, P = _styles()
+    charts = _render_charts(data)
     story = []
 
     # Capa
     title = "Dinâmica do Desmatamento em Roraima em Função da Proximidade das Estradas"
-    subt = f"Período analisado: {y_min}–{y_max}"
+    subt = f"Período analisado: {data.y_min}–{data.y_max}"
     hoje = dt.datetime.now().strftime("%d/%m/%Y %H:%M")
     story += [
         Spacer(1, 1.0*cm),
@@ -327,11 +487,11 @@ def build_pdf(output_path: Path,
 
     # Sumário geral
     story += [Paragraph("1. Sumário geral", H1)]
-    total_area = by_year["area_ha"].sum()
-    n_munis = muni_total["MUN_NAME"].nunique()
+    total_area = data.by_year["area_ha"].sum()
+    n_munis = data.muni_total["MUN_NAME"].nunique()
     bullets = [
         f"Área total desmatada no período (todas as faixas): <b>{fmt_float2_br(total_area)}</b> ha",
-        f"Anos: <b>{y_min}–{y_max}</b>",
+        f"Anos: <b>{data.y_min}–{data.y_max}</b>",
         f"Municípios com ocorrência: <b>{fmt_int_br(n_munis)}</b>",
     ]
     for b in bullets:
@@ -339,82 +499,35 @@ def build_pdf(output_path: Path,
     story += [Spacer(1, 0.4*cm)]
 
     # gráfico total por ano
-    img_total_by_year = plot_total_by_year(by_year.rename(columns={"area_ha":"area_ha","year":"year"}))
-    story += [Image(img_total_by_year, width=PAGE_IMG_W, height=PAGE_IMG_H), Spacer(1, 0.5*cm)]
-
+    story += [plot_total_by_year(data.by_year), Spacer(1, 0.5*cm)]
 
     # barras por faixa
-    img_ring_bar = plot_ring_bar(by_ring.copy())
-    story += [Image(img_ring_bar, width=PAGE_IMG_W, height=PAGE_IMG_H), PageBreak()]
-
+    story += [plot_ring_bar(data.by_ring), PageBreak()]
 
     # 2. Rankings
     story += [Paragraph("2. Rankings de desmatamento (ha)", H1)]
     story += [Paragraph("2.1. Top 10 — acumulado no período", H2)]
-    table_data = [["#","Município","Área (ha)"]]
-    for i, row in enumerate(top_total.itertuples(index=False), start=1):
-        table_data.append([i, row.MUN_NAME, fmt_float2_br(row.area_ha)])
-    t = Table(table_data, hAlign="LEFT", colWidths=[1.2*cm, 9*cm, 4*cm])
-    t.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),
-        ("TEXTCOLOR", (0,0), (-1,0), colors.black),
-        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-        ("ALIGN", (0,0), (0,-1), "CENTER"),
-        ("ALIGN", (-1,1), (-1,-1), "RIGHT"),
-        ("INNERGRID", (0,0), (-1,-1), 0.25, colors.HexColor("#D1D5DB")),
-        ("BOX", (0,0), (-1,-1), 0.5, colors.HexColor("#9CA3AF")),
-    ]))
-    story += [t, Spacer(1, 0.5*cm)]
-
-    story += [Paragraph(f"2.2. Top 10 — ano {last_year}", H2)]
-    table_data = [["#","Município",f"Área (ha) {last_year}"]]
-    for i, row in enumerate(top_last_year.itertuples(index=False), start=1):
-        table_data.append([i, row.MUN_NAME, fmt_float2_br(row.area_ha)])
-    t = Table(table_data, hAlign="LEFT", colWidths=[1.2*cm, 9*cm, 4*cm])
-    t.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),
-        ("FONTNAME", (0,0), (-1,0), "Times New Roman"),
-        ("ALIGN", (0,0), (0,-1), "CENTER"),
-        ("ALIGN", (-1,1), (-1,-1), "RIGHT"),
-        ("INNERGRID", (0,0), (-1,-1), 0.25, colors.HexColor("#D1D5DB")),
-        ("BOX", (0,0), (-1,-1), 0.5, colors.HexColor("#9CA3AF")),
-    ]))
-    story += [t, PageBreak()]
+    story += [_rank_table(data.top_total, "Área (ha)"), Spacer(1, 0.5*cm)]
+
+    story += [Paragraph(f"2.2. Top 10 — ano {data.last_year}", H2)]
+    story += [_rank_table(data.top_last_year, f"Área (ha) {data.last_year}"), PageBreak()]
 
     # 3. Detalhe municipal (agregado e gráficos)
     story += [Paragraph("3. Detalhe por município", H1)]
     # tabela geral por município
     muni_tbl = [["Município","Área (ha) (período)"]]
-    for row in muni_total.itertuples(index=False):
-        muni_tbl.append([row.MUN_NAME, fmt_float2_br(row.area_ha)])
-    t = Table(muni_tbl, hAlign="LEFT", colWidths=[10*cm, 4.5*cm])
-    t.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),
-        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-        ("ALIGN", (-1,1), (-1,-1), "RIGHT"),
-        ("INNERGRID", (0,0), (-1,-1), 0.25, colors.HexColor("#D1D5DB")),
-        ("BOX", (0,0), (-1,-1), 0.5, colors.HexColor("#9CA3AF")),
-    ]))
-    story += [t, Spacer(1, 0.4*cm)]
+    muni_tbl += [list(r) for r in zip(data.muni_total["MUN_NAME"].tolist(),
+                                      fmt_float2_br_series(data.muni_total["area_ha"]).tolist())]
+    story += [_table(muni_tbl, [10*cm, 4.5*cm], center_first=False), Spacer(1, 0.4*cm)]
 
     # gráfico barras empilhadas (top N p/ caber)
-    top_munis_list = muni_total.head(12)["MUN_NAME"].tolist()
-    img_muni_stack = plot_muni_ring_stacked(muni_ring[muni_ring["MUN_NAME"].isin(top_munis_list)].copy())
-    story += [Image(img_muni_stack, width=PAGE_IMG_W, height=PAGE_IMG_H), PageBreak()]
-
+    story += [Image(io.BytesIO(charts["muni_stack"]), width=PAGE_IMG_W, height=PAGE_IMG_H), PageBreak()]
 
     # Facetas por município (séries) em blocos para não ficar gigante
-    chunk_size = 4
-    muni_list = muni_total["MUN_NAME"].tolist()
-    if municipios_filtro:
-        # respeita ordem do filtro, se vieram poucos
-        muni_list = [m for m in municipios_filtro if m in muni_list]
-    for i in range(0, len(muni_list), chunk_size):
-        chunk = muni_list[i:i+chunk_size]
-        story += [Paragraph(f"3.{i//chunk_size+1} Séries temporais — municípios {i+1}–{i+len(chunk)}", H2)]
-        img = plot_ts_facets(muni_year_ring[muni_year_ring["MUN_NAME"].isin(chunk)].copy(), chunk)
-        story += [Image(img, width=PAGE_IMG_W, height=PAGE_IMG_H_TALL), PageBreak()]
-
+    for j, chunk in enumerate(_muni_chunks(data)):
+        i = j * CHUNK_SIZE
+        story += [Paragraph(f"3.{j+1} Séries temporais — municípios {i+1}–{i+len(chunk)}", H2)]
+        story += [Image(io.BytesIO(charts[("ts", j)]), width=PAGE_IMG_W, height=PAGE_IMG_H_TALL), PageBreak()]
 
     # 4. Metodologia resumida
     story += [Paragraph("4. Metodologia (resumo)", H1)]
@@ -425,209 +538,41 @@ def build_pdf(output_path: Path,
     story += [Spacer(1, 0.2*cm)]
     story += [Paragraph("Obs.: este relatório foi gerado automaticamente a partir dos arquivos do projeto. "
                         "Para reproduzir, verifique a existência dos arquivos DuckDB e GeoParquet descritos no cabeçalho.", P)]
+    return story
 
-    # build
+def _render(story: list, target) -> None:
+    """Monta o PDF em `target` (caminho ou buffer)."""
+    doc = SimpleDocTemplate(
+        target,
+        pagesize=A4,
+        leftMargin=1.6*cm, rightMargin=1.6*cm,
+        topMargin=1.2*cm, bottomMargin=1.2*cm
+    )
     doc.build(story)
+
+def build_pdf(output_path: Path,
+              years: tuple[int,int] | None,
+              municipios_filtro: list[str] | None):
+    try:
+        data = prepare_datasets(years, municipios_filtro)
+    except FileNotFoundError as e:
+        print(f"[ERRO] {e}", file=sys.stderr); sys.exit(2)
+
+    ensure_dir(output_path.parent)
+    _render(_build_story(data), output_path.as_posix())
     print(f"[OK] PDF gerado em: {output_path}")
-    
 
-# === NOVO: gerar PDF em memória (bytes) para o Streamlit ===
+
+# === gerar PDF em memória (bytes) para o Streamlit ===
 def build_pdf_bytes(years: tuple[int,int] | None, municipios_filtro: list[str] | None) -> bytes:
     """
     Gera o PDF em memória e retorna bytes (para usar no Streamlit).
-    Usa o mesmo conteúdo do build_pdf(), mas em buffer BytesIO.
+    Mesmo conteúdo do build_pdf(), mas em buffer BytesIO.
     """
-    import io
-    if not DB_PATH.exists():
-        raise FileNotFoundError(f"DuckDB não encontrado: {DB_PATH}")
-    if not PARQUET_PATH.exists():
-        raise FileNotFoundError(f"GeoParquet não encontrado: {PARQUET_PATH}")
-
-    # Reutiliza a lógica de build_pdf, mas monta 'story' aqui e grava em buffer.
-    # (Copiamos o corpo de build_pdf até a parte de doc.build(story))
-    # --- INÍCIO bloco reaproveitado ---
-    # anos limites
-    yrs = read_duck("SELECT MIN(year) AS y0, MAX(year) AS y1 FROM by_ring_year;")
-    y0, y1 = int(yrs["y0"].iloc[0]), int(yrs["y1"].iloc[0])
-    if years is None:
-        y_min, y_max = y0, y1
-    else:
-        y_min, y_max = max(y0, years[0]), min(y1, years[1])
-
-    by_ring_year = read_duck("""
-        SELECT ring_id, year, area_ha
-        FROM by_ring_year
-        WHERE year BETWEEN ? AND ?
-    """, [y_min, y_max])
-    by_ring = (by_ring_year.groupby("ring_id", as_index=False)["area_ha"].sum()
-               .sort_values("ring_id"))
-    by_year = (by_ring_year.groupby("year", as_index=False)["area_ha"].sum()
-               .sort_values("year"))
-
-    inter = load_intersection_gpq(PARQUET_PATH)
-    year_col = next(c for c in inter.columns if c.lower()=="year")
-    inter = inter.rename(columns={year_col: "year"})
-    inter = inter[(inter["year"]>=y_min) & (inter["year"]<=y_max)].copy()
-    if inter.crs is None:
-        inter = inter.set_crs(EQUAL_AREA)
-    elif str(inter.crs).lower() != EQUAL_AREA.lower():
-        inter = inter.to_crs(EQUAL_AREA)
-    inter["area_ha"] = inter.geometry.area / 10_000.0
-
-    mun = load_municipios(MUN_PATH).to_crs(EQUAL_AREA)
-    bbox = mun.union_all().envelope
-    inter_clip = gpd.clip(inter, bbox)
-    inter_muni = gpd.sjoin(
-        inter_clip[["ring_id","year","area_ha","geometry"]],
-        mun[["MUN_NAME","geometry"]],
-        how="inner",
-        predicate="intersects"
-    ).drop(columns=["index_right"])
-    if municipios_filtro:
-        inter_muni = inter_muni[inter_muni["MUN_NAME"].isin(municipios_filtro)].copy()
-
-    muni_total = (inter_muni.groupby("MUN_NAME", as_index=False)["area_ha"].sum()
-                  .sort_values("area_ha", ascending=False))
-    muni_ring = (inter_muni.groupby(["MUN_NAME","ring_id"], as_index=False)["area_ha"].sum())
-    muni_year_ring = (inter_muni.groupby(["MUN_NAME","year","ring_id"], as_index=False)["area_ha"].sum()
-                      .sort_values(["MUN_NAME","year","ring_id"]))
-
-    top_total = muni_total.head(10).copy()
-    last_year = y_max
-    top_last_year = (muni_year_ring[muni_year_ring["year"]==last_year]
-                     .groupby("MUN_NAME", as_index=False)["area_ha"].sum()
-                     .sort_values("area_ha", ascending=False).head(10))
-    # --- FIM bloco de dados ---
-
-    # === estilos / tamanhos ===
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, PageBreak
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib import colors
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.units import cm
-    PAGE_IMG_W = 16*cm
-    PAGE_IMG_H = 9*cm
-    PAGE_IMG_H_TALL = 18*cm
-
-    styles = getSampleStyleSheet()
-    H1 = ParagraphStyle('H1', parent=styles['Heading1'], fontSize=18, spaceAfter=10)
-    H2 = ParagraphStyle('H2', parent=styles['Heading2'], fontSize=14, spaceAfter=8)
-    P  = styles['BodyText']
-
-    # === figuras ===
-    img_total_by_year = plot_total_by_year(by_year.rename(columns={"area_ha":"area_ha","year":"year"}))
-    img_ring_bar = plot_ring_bar(by_ring.copy())
-    top_munis_list = muni_total.head(12)["MUN_NAME"].tolist()
-    img_muni_stack = plot_muni_ring_stacked(muni_ring[muni_ring["MUN_NAME"].isin(top_munis_list)].copy())
-
-    # === story ===
-    story = []
-    title = "Dinâmica do Desmatamento em Roraima em Função da Proximidade das Estradas"
-    subt = f"Período analisado: {y_min}–{y_max}"
-
-    import datetime as dt
-    hoje = dt.datetime.now().strftime("%d/%m/%Y %H:%M")
-    story += [
-        Spacer(1, 1.0*cm),
-        Paragraph(title, H1),
-        Paragraph(subt, P),
-        Spacer(1, 0.2*cm),
-        Paragraph("Fonte: INPE/PRODES, OSM (estradas), IBGE (municípios). Agregados: DuckDB; Geometrias: GeoParquet.", P),
-        Spacer(1, 0.2*cm),
-        Paragraph(f"Geração: {hoje}", P),
-        PageBreak()
-    ]
-
-    total_area = by_year["area_ha"].sum()
-    n_munis = muni_total["MUN_NAME"].nunique()
-    story += [Paragraph("1. Sumário geral", H1)]
-    bullets = [
-        f"Área total desmatada (todas as faixas): <b>{fmt_float2_br(total_area)}</b> ha",
-        f"Anos: <b>{y_min}–{y_max}</b>",
-        f"Municípios com ocorrência: <b>{fmt_int_br(n_munis)}</b>",
-    ]
-    for b in bullets:
-        story += [Paragraph("• " + b, P)]
-    story += [Spacer(1, 0.4*cm)]
-    story += [Image(img_total_by_year, width=PAGE_IMG_W, height=PAGE_IMG_H), Spacer(1, 0.5*cm)]
-    story += [Image(img_ring_bar, width=PAGE_IMG_W, height=PAGE_IMG_H), PageBreak()]
-
-    story += [Paragraph("2. Rankings de desmatamento (ha)", H1)]
-    story += [Paragraph("2.1. Top 10 — acumulado no período", H2)]
-    table_data = [["#","Município","Área (ha)"]]
-    for i, row in enumerate(top_total.itertuples(index=False), start=1):
-        table_data.append([i, row.MUN_NAME, fmt_float2_br(row.area_ha)])
-    from reportlab.platypus import Table
-    t = Table(table_data, hAlign="LEFT", colWidths=[1.2*cm, 9*cm, 4*cm])
-    t.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),
-        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-        ("ALIGN", (0,0), (0,-1), "CENTER"),
-        ("ALIGN", (-1,1), (-1,-1), "RIGHT"),
-        ("INNERGRID", (0,0), (-1,-1), 0.25, colors.HexColor("#D1D5DB")),
-        ("BOX", (0,0), (-1,-1), 0.5, colors.HexColor("#9CA3AF")),
-    ]))
-    story += [t, Spacer(1, 0.5*cm)]
-
-    story += [Paragraph(f"2.2. Top 10 — ano {y_max}", H2)]
-    table_data = [["#","Município",f"Área (ha) {y_max}"]]
-    for i, row in enumerate(top_last_year.itertuples(index=False), start=1):
-        table_data.append([i, row.MUN_NAME, fmt_float2_br(row.area_ha)])
-    t = Table(table_data, hAlign="LEFT", colWidths=[1.2*cm, 9*cm, 4*cm])
-    t.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),
-        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-        ("ALIGN", (0,0), (0,-1), "CENTER"),
-        ("ALIGN", (-1,1), (-1,-1), "RIGHT"),
-        ("INNERGRID", (0,0), (-1,-1), 0.25, colors.HexColor("#D1D5DB")),
-        ("BOX", (0,0), (-1,-1), 0.5, colors.HexColor("#9CA3AF")),
-    ]))
-    story += [t, PageBreak()]
-
-    story += [Paragraph("3. Detalhe por município", H1)]
-    muni_tbl = [["Município","Área (ha) (período)"]]
-    for row in muni_total.itertuples(index=False):
-        muni_tbl.append([row.MUN_NAME, fmt_float2_br(row.area_ha)])
-    t = Table(muni_tbl, hAlign="LEFT", colWidths=[10*cm, 4.5*cm])
-    t.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),
-        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-        ("ALIGN", (-1,1), (-1,-1), "RIGHT"),
-        ("INNERGRID", (0,0), (-1,-1), 0.25, colors.HexColor("#D1D5DB")),
-        ("BOX", (0,0), (-1,-1), 0.5, colors.HexColor("#9CA3AF")),
-    ]))
-    story += [t, Spacer(1, 0.4*cm)]
-
-    story += [Image(img_muni_stack, width=PAGE_IMG_W, height=PAGE_IMG_H), PageBreak()]
-
-    # facetas por município em blocos
-    chunk_size = 4
-    muni_list = muni_total["MUN_NAME"].tolist()
-    if municipios_filtro:
-        muni_list = [m for m in municipios_filtro if m in muni_list]
-    for i in range(0, len(muni_list), chunk_size):
-        chunk = muni_list[i:i+chunk_size]
-        story += [Paragraph(f"Séries temporais — municípios {i+1}–{i+len(chunk)}", H2)]
-        img = plot_ts_facets(muni_year_ring[muni_year_ring["MUN_NAME"].isin(chunk)].copy(), chunk)
-        story += [Image(img, width=PAGE_IMG_W, height=PAGE_IMG_H_TALL), PageBreak()]
-
-    metod = (
-        "Os polígonos anuais de desmatamento do PRODES foram intersectados com anéis exclusivos de distância às "
-        "estradas do OpenStreetMap (0–5 km, 5–10 km, 10–20 km e >20 km), todos em projeção equivalente (EPSG:5880). "
-        "As áreas foram calculadas em hectares (1 ha = 10.000 m²). Em seguida, agregamos por ano, por faixa de distância e "
-        "por município (IBGE)."
-    )
-    story += [Paragraph("Metodologia (resumo)", H1), Paragraph(metod, P)]
-
-    # === monta PDF em memória ===
+    data = prepare_datasets(years, municipios_filtro)
     buf = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buf, pagesize=A4,
-        leftMargin=1.6*cm, rightMargin=1.6*cm, topMargin=1.2*cm, bottomMargin=1.2*cm
-    )
-    doc.build(story)
-    buf.seek(0)
-    return buf.read()
+    _render(_build_story(data), buf)
+    return buf.getvalue()
 
 
 # ----------------------------
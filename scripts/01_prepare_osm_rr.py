@@ -8,7 +8,10 @@
 - Recorta estradas para dentro de Roraima
 - Salva:
     data/processed/roraima_aoi.geojson
-    data/processed/roads_rr.shp
+    data/processed/roads_rr.parquet       (GeoParquet, zstd + coluna bbox)
+    data/processed/roads_rr_5880.parquet  (idem, já em EPSG:5880 — lido por 03)
+    data/processed/roraima_aoi_5880.parquet (AOI em EPSG:5880 — lida por 03)
+    data/processed/roads_rr_simpl.parquet   (WGS84, classes principais, simplificado e arredondado — camada de rodovias do app)
 
 Rodar (na raiz do projeto):
     python .\scripts\01_prepare_osm_rr_ibge.py
@@ -17,6 +20,9 @@ Rodar (na raiz do projeto):
 from pathlib import Path
 import sys
 import geopandas as gpd
+import pandas as pd
+import pyogrio
+import shapely
 
 PROJ_ROOT = Path(__file__).resolve().parents[1]
 DATA_OSM  = PROJ_ROOT / "data" / "osm"
@@ -25,6 +31,11 @@ OUT_DIR   = PROJ_ROOT / "data" / "processed"
 
 ROADS_NAME = "gis_osm_roads_free_1.shp"
 DEFAULT_GEO = "EPSG:4326"
+EQUAL_AREA = "EPSG:5880"     # SIRGAS 2000 / Brazil Polyconic (métrico) — CRS dos passos seguintes
+MAP_SIMPLIFY_DEG = 0.00010   # tolerância (graus) das rodovias no mapa do app
+MAP_PRECISION_DEG = 1e-5     # grade de arredondamento (graus) — mesma do app
+MAP_CLASSES = ["motorway", "trunk", "primary", "secondary"]   # classes exibidas no mapa
+ROAD_COLS = ["osm_id", "fclass", "ref", "name"]                # atributos usados adiante (03, mapa do app)
 
 UF_SIGLA_CANDS = ["SIGLA_UF", "SIGLA", "CD_UF", "UF", "UF_SIGLA", "SG_UF"]
 UF_NOME_CANDS  = ["NM_UF", "NOME_UF", "NM_ESTADO", "NMUF", "NOME", "NOME_ESTADO"]
@@ -36,56 +47,76 @@ def err(m):
 
 def ensure_dir(p: Path): p.mkdir(parents=True, exist_ok=True)
 
-def load_gdf(path: Path, label: str) -> gpd.GeoDataFrame:
+def load_gdf(path: Path, label: str, columns: list[str] | None = None, where: str | None = None,
+             bbox: tuple | None = None) -> gpd.GeoDataFrame:
     if not path.exists(): err(f"{label} não encontrado: {path}")
-    gdf = gpd.read_file(path)
+    # pyogrio/Arrow: bem mais rápido que fiona; columns/where/bbox filtram já no GDAL
+    gdf = gpd.read_file(path, engine="pyogrio", use_arrow=True, columns=columns, where=where, bbox=bbox)
     if gdf.crs is None:
         gdf.set_crs(DEFAULT_GEO, inplace=True)
         warn(f"{label} sem CRS — assumindo {DEFAULT_GEO}.")
     return gdf
 
+def bbox_in_layer_crs(aoi: gpd.GeoDataFrame, path: Path) -> tuple[float, float, float, float]:
+    """Envelope da AOI no CRS da camada em disco (p/ o filtro espacial do GDAL na leitura)."""
+    crs = pyogrio.read_info(path)["crs"] or DEFAULT_GEO
+    return tuple(float(v) for v in aoi.to_crs(crs).total_bounds)
+
 def find_col(gdf: gpd.GeoDataFrame, candidates) -> str | None:
     lower = {c.lower(): c for c in gdf.columns}
     for c in candidates:
         if c.lower() in lower: return lower[c.lower()]
     return None
 
-def pick_rr_from_ibge(ibge: gpd.GeoDataFrame) -> gpd.GeoDataFrame | None:
-    sigla = find_col(ibge, UF_SIGLA_CANDS)
+def load_rr_from_ibge(path: Path) -> gpd.GeoDataFrame | None:
+    """Lê só a linha de Roraima (filtro SQL no OGR pela coluna de sigla); sem sigla 'RR', lê tudo e procura."""
+    fields = list(pyogrio.read_info(path)["fields"])
+    sigla = next((f for c in UF_SIGLA_CANDS for f in fields if f.lower() == c.lower()), None)
     if sigla:
-        m = ibge[sigla].astype(str).str.upper().str.strip().eq("RR")
-        rr = ibge[m].copy()
-        if not rr.empty: return rr.dissolve().reset_index(drop=True)
-    nome = find_col(ibge, UF_NOME_CANDS)
-    if nome:
-        m = ibge[nome].astype(str).str.lower().str.strip().eq("roraima")
-        rr = ibge[m].copy()
-        if not rr.empty: return rr.dissolve().reset_index(drop=True)
+        rr = load_gdf(path, "IBGE UFs", where=f"\"{sigla}\" IN ('RR', 'rr')")
+        if not rr.empty:
+            return rr.dissolve().reset_index(drop=True)
+    return pick_rr_from_ibge(load_gdf(path, "IBGE UFs"))
+
+def pick_rr_from_ibge(ibge: gpd.GeoDataFrame) -> gpd.GeoDataFrame | None:
+    # colunas de texto normalizadas uma vez só (maiúsculas, sem espaços nas pontas)
+    text = {c: ibge[c].astype("string").str.strip().str.upper()
+            for c in ibge.columns if ibge[c].dtype == object}
+    sigla, nome = find_col(ibge, UF_SIGLA_CANDS), find_col(ibge, UF_NOME_CANDS)
+    tests = []
+    if sigla in text: tests.append(lambda: text[sigla].eq("RR"))
+    if nome in text:  tests.append(lambda: text[nome].eq("RORAIMA"))
     # fallback: qualquer coluna contendo "roraima"
-    for col in ibge.columns:
-        if ibge[col].dtype == object:
-            m = ibge[col].astype(str).str.lower().str.contains("roraima", na=False)
-            rr = ibge[m].copy()
-            if not rr.empty: return rr.dissolve().reset_index(drop=True)
+    tests += [lambda s=s: s.str.contains("RORAIMA", regex=False) for s in text.values()]
+    for test in tests:   # para no primeiro critério que achar algo
+        m = test().fillna(False).to_numpy(dtype=bool)
+        if m.any():
+            return ibge[m].dissolve().reset_index(drop=True)
     return None
 
-def clip_roads(roads: gpd.GeoDataFrame, aoi: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    if roads.crs != aoi.crs:
-        roads = roads.to_crs(aoi.crs)
-    try:
-        return gpd.clip(roads, aoi)
-    except Exception:
-        return gpd.overlay(roads, aoi[["geometry"]], how="intersection")
+def clip_roads(roads: gpd.GeoDataFrame, aoi_geom, aoi_crs) -> gpd.GeoDataFrame:
+    """
+    Recorte das estradas pela AOI (aoi_geom: polígono único, já dissolvido, em aoi_crs):
+    candidatos pelo STRtree das estradas (uma consulta só) e interseção vetorizada do shapely 2
+    apenas neles — sem o caminho lento do gpd.clip p/ linhas.
+    """
+    if roads.crs != aoi_crs:
+        roads = roads.to_crs(aoi_crs)
+    idx = roads.sindex.query(aoi_geom, predicate="intersects")
+    idx.sort()   # mantém a ordem original dos segmentos
+    out = roads.iloc[idx]
+    out = out.set_geometry(gpd.GeoSeries(
+        shapely.intersection(out.geometry.values, aoi_geom), index=out.index, crs=out.crs))
+    # toque pontual na divisa vira GeometryCollection/Point: fica só a parte linear (como o clip)
+    gc = out.geom_type == "GeometryCollection"
+    if gc.any():
+        out = pd.concat([out[~gc], out[gc].explode(index_parts=False)]).sort_index(kind="stable")
+    return out[out.geom_type.isin(["LineString", "MultiLineString"])]
 
 def main():
     ensure_dir(OUT_DIR)
 
-    # 1) Estradas do OSM
-    roads_path = DATA_OSM / ROADS_NAME
-    info(f"Lendo estradas OSM: {roads_path}")
-    roads = load_gdf(roads_path, "roads OSM")
-
-    # 2) IBGE UFs
+    # 1) IBGE UFs (primeiro: o envelope de RR filtra a leitura das estradas)
     if not DATA_IBGE.exists():
         err(f"Pasta do IBGE não existe: {DATA_IBGE}. Coloque lá o shapefile de UFs (ex.: BR_UF_2024.shp).")
     shp_list = list(DATA_IBGE.glob("*.shp")) or list(DATA_IBGE.rglob("*.shp"))
@@ -95,25 +126,57 @@ def main():
     shp_list.sort(key=lambda p: (("UF" not in p.name.upper()), p.name.upper()))
     ibge_path = shp_list[0]
     info(f"Lendo IBGE UFs: {ibge_path}")
-    ibge = load_gdf(ibge_path, "IBGE UFs")
 
-    # 3) Extrai Roraima
-    aoi_rr = pick_rr_from_ibge(ibge)
+    # 2) Extrai Roraima
+    aoi_rr = load_rr_from_ibge(ibge_path)
     if aoi_rr is None or aoi_rr.empty:
         err("Não achei Roraima no shapefile do IBGE (nem por sigla, nem por nome).")
 
-    # 4) Salva AOI
+    aoi_union = shapely.union_all(aoi_rr.geometry.values)   # AOI dissolvida uma vez só, reusada no recorte
+
+    # 3) Salva AOI
     aoi_out = OUT_DIR / "roraima_aoi.geojson"
     aoi_rr.to_file(aoi_out, driver="GeoJSON")
     info(f"[OK] AOI salva: {aoi_out}")
+    # AOI já reprojetada p/ os passos métricos (03): reprojeta uma vez aqui, não a cada script
+    aoi_m_out = OUT_DIR / "roraima_aoi_5880.parquet"
+    aoi_rr.to_crs(EQUAL_AREA).to_parquet(aoi_m_out, index=False)
+    info(f"[OK] AOI (EPSG:5880) salva: {aoi_m_out}")
+
+    # 4) Estradas do OSM — só as que caem no envelope de RR (o resto do Brasil nem é lido)
+    roads_path = DATA_OSM / ROADS_NAME
+    info(f"Lendo estradas OSM: {roads_path}")
+    if not roads_path.exists(): err(f"roads OSM não encontrado: {roads_path}")
+    fields = pyogrio.read_info(roads_path)["fields"]
+    roads = load_gdf(roads_path, "roads OSM", columns=[c for c in ROAD_COLS if c in fields],
+                     bbox=bbox_in_layer_crs(aoi_rr, roads_path))
+    info(f"Segmentos no envelope de RR: {len(roads)}")
 
     # 5) Recorta estradas
     info("Recortando estradas dentro de Roraima…")
-    roads_rr = clip_roads(roads, aoi_rr)
-    roads_out = OUT_DIR / "roads_rr.shp"
-    roads_rr.to_file(roads_out)
+    roads_rr = clip_roads(roads, aoi_union, aoi_rr.crs)
+    roads_out = OUT_DIR / "roads_rr.parquet"
+    # GeoParquet (zstd + bbox de cobertura): bem menor e mais rápido de ler que shapefile, com CRS e tipos
+    roads_rr.to_parquet(roads_out, index=False, compression="zstd", write_covering_bbox=True)
     info(f"[OK] Estradas salvas: {roads_out}")
     info(f"[OK] Total de segmentos: {len(roads_rr)}")
+    roads_m_out = OUT_DIR / "roads_rr_5880.parquet"
+    roads_rr.to_crs(EQUAL_AREA).to_parquet(roads_m_out, index=False, compression="zstd", write_covering_bbox=True)
+    info(f"[OK] Estradas (EPSG:5880) salvas: {roads_m_out}")
+
+    # 6) Versão p/ o mapa do app: só classes principais, simplificada e arredondada
+    #    (no app vira uma única leitura de parquet, sem shapefile nem simplify)
+    roads_map = roads_rr[[c for c in ["fclass", "ref", "name", "geometry"] if c in roads_rr.columns]]
+    if "fclass" in roads_map.columns:
+        roads_map = roads_map[roads_map["fclass"].isin(MAP_CLASSES)]
+    roads_map = roads_map.to_crs(DEFAULT_GEO)
+    geoms = roads_map.geometry.simplify(MAP_SIMPLIFY_DEG, preserve_topology=True).values
+    roads_map = roads_map.set_geometry(gpd.GeoSeries(
+        shapely.set_precision(geoms, MAP_PRECISION_DEG), index=roads_map.index, crs=roads_map.crs))
+    roads_map = roads_map[~roads_map.geometry.is_empty]
+    roads_map_out = OUT_DIR / "roads_rr_simpl.parquet"
+    roads_map.to_parquet(roads_map_out, index=False)
+    info(f"[OK] Estradas simplificadas (mapa): {roads_map_out}")
 
 if __name__ == "__main__":
     main()
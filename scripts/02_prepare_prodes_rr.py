@@ -4,16 +4,20 @@
 02_prepare_prodes_rr.py
 - Recorta PRODES (yearly_deforestation_biome.shp) para dentro de Roraima (AOI)
 - Saídas:
-    data/processed/deforestation_rr.shp
+    data/processed/deforestation_rr.parquet   (GeoParquet em EPSG:5880, zstd + coluna bbox)
     data/processed/deforestation_rr_preview.geojson  (amostra pequena p/ visualizar rápido)
 Uso:
     python scripts/02_prepare_prodes_rr.py
 """
 
 from pathlib import Path
+from collections.abc import Iterator
 import sys
 import geopandas as gpd
+import pyogrio
 import pandas as pd
+import pyarrow as pa
+import shapely
 
 PROJ_ROOT = Path(__file__).resolve().parents[1]
 AOI_PATH  = PROJ_ROOT / "data" / "processed" / "roraima_aoi.geojson"
@@ -21,10 +25,13 @@ PRODES_DIR = PROJ_ROOT / "data" / "prodes"
 PRODES_NAME = "yearly_deforestation_biome.shp"   # ajuste se o seu nome for diferente
 
 OUT_DIR   = PROJ_ROOT / "data" / "processed"
-OUT_SHP   = OUT_DIR / "deforestation_rr.shp"
+OUT_PARQUET = OUT_DIR / "deforestation_rr.parquet"
 OUT_PREV  = OUT_DIR / "deforestation_rr_preview.geojson"
 
 DEFAULT_GEO = "EPSG:4326"
+EQUAL_AREA = "EPSG:5880"   # SIRGAS 2000 / Brazil Polyconic — CRS de 04/05 (lá o to_crs vira no-op)
+PRODES_COLS = ["year", "ano", "main_class"]   # atributos usados adiante (04/05); o resto nem é lido
+BATCH_SIZE = 50_000                            # feições por lote na leitura em streaming do PRODES
 
 def info(m): print(f"[INFO] {m}")
 def warn(m): print(f"[AVISO] {m}")
@@ -33,40 +40,85 @@ def err(m):
 
 def load_gdf(path: Path, label: str) -> gpd.GeoDataFrame:
     if not path.exists(): err(f"{label} não encontrado: {path}")
-    gdf = gpd.read_file(path)
+    gdf = gpd.read_file(path, engine="pyogrio", use_arrow=True)   # pyogrio/Arrow: bem mais rápido que fiona
     if gdf.crs is None:
         gdf.set_crs(DEFAULT_GEO, inplace=True)
         warn(f"{label} sem CRS — assumindo {DEFAULT_GEO}.")
     return gdf
 
+def bbox_in_layer_crs(aoi: gpd.GeoDataFrame, path: Path) -> tuple[float, float, float, float]:
+    """Envelope da AOI no CRS da camada em disco (p/ o filtro espacial do GDAL na leitura)."""
+    crs = pyogrio.read_info(path)["crs"] or DEFAULT_GEO
+    return tuple(float(v) for v in aoi.to_crs(crs).total_bounds)
+
+def clip_prodes(prodes: gpd.GeoDataFrame, aoi_geom) -> gpd.GeoDataFrame:
+    """
+    Recorte do PRODES pela AOI (aoi_geom: polígono único, já dissolvido): candidatos pelo
+    STRtree (uma consulta só) e interseção vetorizada do shapely 2 apenas neles, no lugar do gpd.overlay.
+    """
+    idx = prodes.sindex.query(aoi_geom, predicate="intersects")
+    idx.sort()
+    out = prodes.iloc[idx]
+    geoms = out.geometry.values.copy()
+    bad = ~shapely.is_valid(geoms)   # polígono inválido derruba o GEOS: conserta só esses
+    if bad.any():
+        geoms[bad] = shapely.make_valid(geoms[bad])
+    out = out.set_geometry(gpd.GeoSeries(shapely.intersection(geoms, aoi_geom), index=out.index, crs=out.crs))
+    # bordas que só tocam a divisa viram linha/ponto: fica só a parte poligonal (como o overlay)
+    gc = out.geom_type == "GeometryCollection"
+    if gc.any():
+        out = pd.concat([out[~gc], out[gc].explode(index_parts=False)]).sort_index(kind="stable")
+    return out[out.geom_type.isin(["Polygon", "MultiPolygon"])].reset_index(drop=True)
+
+def iter_prodes(path: Path, columns: list[str] | None, bbox: tuple) -> Iterator[gpd.GeoDataFrame]:
+    """
+    PRODES em lotes de BATCH_SIZE feições (stream Arrow do GDAL via pyogrio): só um lote do
+    bioma fica em memória por vez, em vez da camada inteira.
+    """
+    with pyogrio.open_arrow(path, columns=columns, bbox=bbox, batch_size=BATCH_SIZE, use_pyarrow=True) as (meta, reader):
+        crs = meta["crs"] or DEFAULT_GEO
+        if meta["crs"] is None:
+            warn(f"PRODES sem CRS — assumindo {DEFAULT_GEO}.")
+        geom_col = meta["geometry_name"] or "wkb_geometry"
+        for batch in reader:
+            tbl = pa.Table.from_batches([batch])
+            df = tbl.select([c for c in tbl.column_names if c != geom_col]).to_pandas()
+            geoms = shapely.from_wkb(tbl.column(geom_col).to_numpy())
+            yield gpd.GeoDataFrame(df, geometry=geoms, crs=crs)
+
 def main():
     OUT_DIR.mkdir(parents=True, exist_ok=True)
 
     # 1) AOI
     info(f"Lendo AOI: {AOI_PATH}")
     aoi = load_gdf(AOI_PATH, "AOI")
+    aoi_union = shapely.union_all(aoi.geometry.values)   # AOI dissolvida uma vez só
 
     # 2) PRODES
     prodes_path = PRODES_DIR / PRODES_NAME
     info(f"Lendo PRODES: {prodes_path}")
-    prodes = load_gdf(prodes_path, "PRODES")
-
-    # 3) Recorte
-    if prodes.crs != aoi.crs:
-        prodes = prodes.to_crs(aoi.crs)
-
-    info("Recortando PRODES para dentro de Roraima…")
-    try:
-        clipped = gpd.overlay(prodes, aoi[["geometry"]], how="intersection")
-    except Exception:
-        # fallback com clip (funciona bem para polígonos)
-        clipped = gpd.clip(prodes, aoi)
+    if not prodes_path.exists(): err(f"PRODES não encontrado: {prodes_path}")
+    fields = pyogrio.read_info(prodes_path)["fields"]
+    keep = [f for f in fields if f.lower() in PRODES_COLS] or None   # nomes fora do padrão: lê tudo
+    # 3) Recorte em streaming: só polígonos no envelope de RR, lote a lote (lê, reprojeta, recorta e
+    #    descarta o lote); em memória fica só o que cai dentro de Roraima
+    info("Recortando PRODES para dentro de Roraima (em lotes)…")
+    parts, n_lidas = [], 0
+    for chunk in iter_prodes(prodes_path, keep, bbox_in_layer_crs(aoi, prodes_path)):
+        n_lidas += len(chunk)
+        if chunk.crs != aoi.crs:
+            chunk = chunk.to_crs(aoi.crs)
+        parts.append(clip_prodes(chunk, aoi_union))
+    info(f"Feições no envelope de RR: {n_lidas}")
+    if not parts:
+        err("Nenhuma feição do PRODES no envelope de Roraima.")
+    clipped = gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=aoi.crs)
 
     info(f"[OK] Feições após recorte: {len(clipped)}")
 
     # 4) Salvar
-    clipped.to_file(OUT_SHP)
-    info(f"[OK] Shapefile salvo: {OUT_SHP}")
+    clipped.to_crs(EQUAL_AREA).to_parquet(OUT_PARQUET, index=False, compression="zstd", write_covering_bbox=True)
+    info(f"[OK] GeoParquet salvo: {OUT_PARQUET}")
 
     # amostra p/ preview rápido (até 100 features)
     prev = clipped.head(100).to_crs(DEFAULT_GEO)
@@ -82,9 +134,9 @@ def main():
             break
 
     if year_col:
-        stats = (clipped.groupby(year_col).size()
-                 .reset_index(name="n_features")
-                 .sort_values(year_col))
+        # só a coluna de ano (a GeoDataFrame inteira não entra no groupby); anos já saem ordenados
+        stats = (clipped[year_col].groupby(clipped[year_col], sort=True).size()
+                 .reset_index(name="n_features"))
         print("\n[Resumo] Feições por ano:")
         print(stats.to_string(index=False))
     else:
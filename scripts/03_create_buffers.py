@@ -2,31 +2,34 @@
 # -*- coding: utf-8 -*-
 """
 03_create_buffers.py  (robusto, em chunks)
-- Lê AOI (data/processed/roraima_aoi.geojson) e estradas RR (data/processed/roads_rr.shp)
+- Lê AOI e estradas RR já em EPSG:5880 (data/processed/roraima_aoi_5880.parquet, roads_rr_5880.parquet — de 01)
+- Simplifica as estradas (tolerância ~1% do menor buffer; aproximação controlada) antes do buffer
 - Cria buffers em km (ex.: 5 10 20) em LOTES para evitar 'bad allocation'
 - Constrói anéis (0–d1, d1–d2, ..., >dmax), recortados à AOI
 - Saídas:
-    data/processed/buffers/roads_buffer_5km.shp (etc)
-    data/processed/buffers/buffer_rings.shp
+    data/processed/buffers/roads_buffer_5km.parquet (etc)
+    data/processed/buffers/buffer_rings.parquet
     data/processed/buffers/buffer_rings_preview.geojson
 
 Uso:
-    python scripts/03_create_buffers.py --dist 5 10 20 [--chunk-size 20000] [--road-classes primary secondary tertiary]
+    python scripts/03_create_buffers.py --dist 5 10 20 [--chunk-size 20000] [--workers 4] [--simplify-m 50] [--road-classes primary secondary tertiary]
 """
 
 from pathlib import Path
+import os
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import geopandas as gpd
 import pandas as pd
-from shapely.ops import unary_union
+import shapely
 
 PROJ_ROOT = Path(__file__).resolve().parents[1]
 DATA_PROC = PROJ_ROOT / "data" / "processed"
 OUT_DIR   = DATA_PROC / "buffers"
 
-AOI_PATH   = DATA_PROC / "roraima_aoi.geojson"
-ROADS_PATH = DATA_PROC / "roads_rr.shp"
+AOI_PATH   = DATA_PROC / "roraima_aoi_5880.parquet"   # já em EQUAL_AREA (01): sem to_crs aqui
+ROADS_PATH = DATA_PROC / "roads_rr_5880.parquet"
 
 EQUAL_AREA = "EPSG:5880"  # SIRGAS 2000 / Brazil Polyconic
 WGS84      = "EPSG:4326"
@@ -40,13 +43,21 @@ def parse_args():
     ap = argparse.ArgumentParser()
     ap.add_argument("--dist", nargs="+", type=float, required=True, help="Distâncias de buffer em km (ex.: 5 10 20)")
     ap.add_argument("--chunk-size", type=int, default=20000, help="Tamanho do lote para buffer (default=20000)")
+    ap.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                    help="Lotes processados em paralelo (threads; cada lote ocupa memória própria). Default=min(4, nº de CPUs)")
+    ap.add_argument("--simplify-m", type=float, default=None,
+                    help="Tolerância (m) da simplificação das estradas antes do buffer. "
+                         "Default=1%% da menor distância (50 m p/ 5 km); 0 desliga.")
     ap.add_argument("--road-classes", nargs="*", default=None,
                     help="Filtrar estradas por fclass (ex.: primary secondary tertiary trunk motorway).")
     return ap.parse_args()
 
 def load_gdf(path: Path, label: str) -> gpd.GeoDataFrame:
     if not path.exists(): err(f"{label} não encontrado: {path}")
-    gdf = gpd.read_file(path)
+    if path.suffix == ".parquet":
+        gdf = gpd.read_parquet(path)   # intermediários do pipeline (01–03) em GeoParquet
+    else:
+        gdf = gpd.read_file(path, engine="pyogrio", use_arrow=True)   # pyogrio/Arrow: bem mais rápido que fiona
     if gdf.crs is None:
         gdf = gdf.set_crs(WGS84)
         warn(f"{label} sem CRS — assumindo {WGS84}.")
@@ -62,38 +73,42 @@ def filter_by_fclass(roads: gpd.GeoDataFrame, keep: list[str]) -> gpd.GeoDataFra
     info(f"Filtrando por fclass {sorted(kk)} -> {n1}/{n0} segmentos.")
     return roads.loc[m].copy()
 
-def buffer_in_chunks(roads_m: gpd.GeoDataFrame, aoi_m: gpd.GeoDataFrame, d_m: float, chunk_size: int):
+def _buffer_lot(geoms, d_m: float):
+    """Buffer + união de um lote (operações do GEOS soltam o GIL: roda bem em threads)."""
+    lot_union = shapely.union_all(shapely.buffer(geoms, d_m))
+    return None if lot_union.is_empty else lot_union
+
+def _union_tree(parts: list, ex: ThreadPoolExecutor):
+    """União em árvore (pares a pares, cada nível em paralelo): cada passo junta só duas geometrias
+    de tamanho parecido, em vez de acumular tudo numa geometria que cresce a cada lote."""
+    while len(parts) > 1:
+        parts = list(ex.map(shapely.union_all, [parts[i:i+2] for i in range(0, len(parts), 2)]))
+    return parts[0]
+
+def buffer_in_chunks(roads_m: gpd.GeoDataFrame, d_m: float, chunk_size: int, workers: int = 1):
     """
-    Faz buffer por LOTES e recorta pela AOI a cada lote para economizar memória.
-    Retorna uma geometria unificada (MultiPolygon/Polygon) do buffer total.
+    Faz buffer por LOTES (une cada lote p/ economizar memória) e junta os lotes em árvore.
+    Os lotes rodam em paralelo (até `workers`).
+    Retorna uma geometria unificada (MultiPolygon/Polygon) do buffer total, ainda sem recorte pela AOI.
     """
     total = len(roads_m)
-    parts = []
-    for i in range(0, total, chunk_size):
-        j = min(i + chunk_size, total)
-        info(f"  - Lote {i}:{j} de {total} (buffer {d_m/1000:.1f} km)")
-        # buffer vetorizado no lote
-        buf_geoms = roads_m.geometry.iloc[i:j].buffer(d_m)
-        # une o lote
-        lot_union = unary_union(buf_geoms.values)
-        # recorta pelo limite da AOI (reduz tamanho)
-        lot_gdf = gpd.GeoDataFrame(geometry=[lot_union], crs=roads_m.crs)
-        lot_clip = gpd.overlay(lot_gdf, aoi_m[["geometry"]], how="intersection")
-        if not lot_clip.empty:
-            parts.append(lot_clip.geometry.iloc[0])
-        # Libera referências
-        del buf_geoms, lot_union, lot_gdf, lot_clip
-
-    if not parts:
-        return None
-    return unary_union(parts)
+    geoms = roads_m.geometry.values
+    bounds = [(i, min(i + chunk_size, total)) for i in range(0, total, chunk_size)]
+    info(f"  - {len(bounds)} lote(s) de até {chunk_size} segmentos, {workers} em paralelo (buffer {d_m/1000:.1f} km)")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        parts = [p for p in ex.map(lambda ij: _buffer_lot(geoms[ij[0]:ij[1]], d_m), bounds)
+                 if p is not None]
+        if not parts:
+            return None
+        return _union_tree(parts, ex)
 
 def main():
     args = parse_args()
     OUT_DIR.mkdir(parents=True, exist_ok=True)
 
     # 1) carrega AOI e estradas
-    aoi = load_gdf(AOI_PATH, "AOI").to_crs(EQUAL_AREA)
+    aoi = load_gdf(AOI_PATH, "AOI")
+    aoi_union = shapely.union_all(aoi.geometry.values)   # dissolvida uma vez: usada em todo lote e no anel externo
     roads = load_gdf(ROADS_PATH, "Estradas")
 
     # filtro opcional por fclass
@@ -102,21 +117,43 @@ def main():
         if roads.empty:
             err("Filtro por fclass resultou em zero estradas. Remova o filtro ou verifique valores.")
 
-    roads_m = roads.to_crs(EQUAL_AREA)
-
-    # 2) buffers por distância (em chunks)
+    # simplificação antes do buffer: o custo do buffer no GEOS cresce com o nº de vértices, e o traçado
+    # fino do OSM não muda um buffer de km. Aproximação controlada: a borda se desloca no máximo
+    # `tol` metros (1% do menor buffer por padrão); preserve_topology=False é bem mais barato e,
+    # como o resultado só vai ser bufferizado, autointerseções não importam
+    tol = args.simplify_m if args.simplify_m is not None else min(args.dist) * 1000.0 * 0.01
+    if tol > 0:
+        n_before = int(shapely.get_num_coordinates(roads.geometry.values).sum())
+        roads = roads.set_geometry(gpd.GeoSeries(
+            shapely.simplify(roads.geometry.values, tol, preserve_topology=False), index=roads.index, crs=roads.crs))
+        roads = roads[~roads.geometry.is_empty]
+        n_after = int(shapely.get_num_coordinates(roads.geometry.values).sum())
+        info(f"Estradas simplificadas ({tol:.0f} m): {n_before} -> {n_after} vértices")
+
+    # 2) buffers por distância: só o menor sai das linhas (em chunks); cada um dos seguintes é o
+    #    anterior (sem recorte) expandido pela diferença — buffer(buffer(L, a), b) = buffer(L, a + b),
+    #    e bufferizar um polígono já unido custa bem menos que refazer o buffer de todas as linhas
     dists_km = sorted(set(args.dist))
     buffers = []
+    grown, prev_d = None, 0.0
     for d in dists_km:
         d_m = d * 1000.0
-        info(f"Criando buffer de {d} km em chunks de {args.chunk_size}…")
-        union_buf = buffer_in_chunks(roads_m, aoi, d_m, args.chunk_size)
-        if union_buf is None:
-            warn(f"Nenhuma geometria no buffer de {d} km (talvez estradas vazias?). Pulando.")
+        if grown is None:
+            info(f"Criando buffer de {d} km em chunks de {args.chunk_size}…")
+            grown = buffer_in_chunks(roads, d_m, args.chunk_size, args.workers)
+            if grown is None:
+                err("Nenhuma geometria no buffer (talvez estradas vazias?). Verifique os dados de estradas.")
+        else:
+            info(f"Expandindo o buffer de {prev_d} km para {d} km…")
+            grown = shapely.buffer(grown, d_m - prev_d * 1000.0)
+        prev_d = d
+        union_buf = shapely.intersection(grown, aoi_union)   # recorte pela AOI: só na saída
+        if union_buf.is_empty:
+            warn(f"Buffer de {d} km não cruza a AOI. Pulando.")
             continue
         buf_gdf = gpd.GeoDataFrame({"dist_km":[d]}, geometry=[union_buf], crs=EQUAL_AREA)
-        out = OUT_DIR / f"roads_buffer_{int(d)}km.shp"
-        buf_gdf.to_file(out)
+        out = OUT_DIR / f"roads_buffer_{int(d)}km.parquet"
+        buf_gdf.to_parquet(out, index=False, compression="zstd", write_covering_bbox=True)
         info(f"[OK] salvo: {out}")
         buffers.append((d, buf_gdf))
 
@@ -136,12 +173,12 @@ def main():
         prev_d, prev_g = d, g
     # > dmax
     dmax, gmax = buffers[-1]
-    outside = aoi.geometry.unary_union.difference(gmax.geometry.iloc[0])
+    outside = aoi_union.difference(gmax.geometry.iloc[0])
     rings.append({"ring_id": f">{int(dmax)}km", "min_km": float(dmax), "max_km": None, "geometry": outside})
 
     rings_gdf = gpd.GeoDataFrame(rings, geometry="geometry", crs=EQUAL_AREA)
-    rings_out = OUT_DIR / "buffer_rings.shp"
-    rings_gdf.to_file(rings_out)
+    rings_out = OUT_DIR / "buffer_rings.parquet"
+    rings_gdf.to_parquet(rings_out, index=False, compression="zstd", write_covering_bbox=True)
     info(f"[OK] Anéis salvos: {rings_out}")
 
     rings_prev = rings_gdf.to_crs(WGS84)
@@ -149,10 +186,11 @@ def main():
     info(f"[OK] Preview: {OUT_DIR / 'buffer_rings_preview.geojson'}")
 
     # resumo de áreas
-    areas = rings_gdf.copy()
-    areas["area_km2"] = areas.geometry.area / 1_000_000.0
+    # (só ring_id + área: sem copiar a GeoDataFrame com as geometrias dos anéis)
+    areas = pd.DataFrame({"ring_id": rings_gdf["ring_id"].to_numpy(),
+                          "area_km2": shapely.area(rings_gdf.geometry.values) / 1_000_000.0})
     print("\n[Resumo] Área dos anéis (km²):")
-    print(areas[["ring_id","area_km2"]])
+    print(areas)
 
 if __name__ == "__main__":
     main()
@@ -20,14 +20,19 @@ import sys
 import argparse
 import warnings
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import shapely
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from utils import intersect_rings   # compartilhada com 04_intersection.py
 
 PROJ_ROOT = Path(__file__).resolve().parents[1]
 
 DATA_PROC      = PROJ_ROOT / "data" / "processed"
-RINGS_PATH     = DATA_PROC / "buffers" / "buffer_rings.shp"
-PRODES_PATH    = DATA_PROC / "deforestation_rr.shp"
+RINGS_PATH     = DATA_PROC / "buffers" / "buffer_rings.parquet"
+PRODES_PATH    = DATA_PROC / "deforestation_rr.parquet"
 
 OUT_BASE       = PROJ_ROOT / "outputs"
 OUT_TABLES     = OUT_BASE / "tabelas"
@@ -54,7 +59,10 @@ def parse_args():
 
 def load_gdf(path: Path, label: str) -> gpd.GeoDataFrame:
     if not path.exists(): err(f"{label} não encontrado: {path}")
-    gdf = gpd.read_file(path)
+    if path.suffix == ".parquet":
+        gdf = gpd.read_parquet(path)   # intermediários do pipeline (01–03) em GeoParquet
+    else:
+        gdf = gpd.read_file(path, engine="pyogrio", use_arrow=True)   # pyogrio/Arrow: bem mais rápido que fiona
     if gdf.crs is None:
         gdf = gdf.set_crs(WGS84)
         warn(f"{label} sem CRS — assumindo {WGS84}.")
@@ -109,42 +117,35 @@ def main():
 
     # 4) Overlay: PRODES ∩ anéis
     info("Fazendo interseção espacial (PRODES ∩ anéis)…")
-    try:
-        inter = gpd.overlay(prodes_m, rings_m[["ring_id", "geometry"]], how="intersection")
-    except Exception as e:
-        warn(f"Falha no overlay padrão: {e}. Tentando gpd.clip em loop (mais lento).")
-        parts = []
-        for _, ring in rings_m.iterrows():
-            sub = gpd.clip(prodes_m, ring.geometry)
-            if not sub.empty:
-                sub = sub.copy()
-                sub["ring_id"] = ring["ring_id"]
-                parts.append(sub)
-        if not parts:
-            err("Interseção resultou vazia.")
-        inter = gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=prodes_m.crs)
+    inter = intersect_rings(prodes_m, rings_m[["ring_id", "geometry"]])
 
     if inter.empty:
         err("Interseção resultou vazia. Verifique dados/CRS.")
 
     # 5) Área em hectares
-    inter["area_ha"] = inter.geometry.area / 10_000.0
-
-    # 6) Agregações
-    # por ring_id e ano
-    g_year = (inter.groupby(["ring_id", year_col])["area_ha"]
-                   .sum()
-                   .reset_index()
-                   .sort_values([year_col, "ring_id"]))
+    inter["area_ha"] = shapely.area(inter.geometry.values) / 10_000.0   # ufunc do shapely 2 sobre o array inteiro
+
+    # 6) Agregações — tabela enxuta só com os arrays (sem GeoSeries), anel em category e ano em int16
+    slim = pd.DataFrame({
+        "ring_id": pd.Categorical(inter["ring_id"].to_numpy()),
+        year_col: inter[year_col].to_numpy().astype(np.int16),
+        "area_ha": inter["area_ha"].to_numpy(),
+    })
+    # por ano e ring_id — chaves já ordenadas pelo groupby (int16 + category), sem sort_values depois
+    g_year = (slim.groupby([year_col, "ring_id"], observed=True, sort=True)["area_ha"]
+                  .sum()
+                  .reset_index()[["ring_id", year_col, "area_ha"]]
+                  .astype({"ring_id": str}))
     g_year_path = OUT_TABLES / "deforestation_by_ring_year.csv"
     g_year.to_csv(g_year_path, index=False, encoding="utf-8")
     info(f"[OK] Tabela salva: {g_year_path}")
 
     # total por ring_id (no período filtrado)
-    g_tot = (inter.groupby(["ring_id"])["area_ha"]
-                  .sum()
-                  .reset_index()
-                  .sort_values("area_ha", ascending=False))
+    g_tot = (slim.groupby("ring_id", observed=True, sort=False)["area_ha"]
+                 .sum()
+                 .reset_index()
+                 .sort_values("area_ha", ascending=False)
+                 .astype({"ring_id": str}))
     g_tot_path = OUT_TABLES / "deforestation_by_ring_total.csv"
     g_tot.to_csv(g_tot_path, index=False, encoding="utf-8")
     info(f"[OK] Tabela salva: {g_tot_path}")
@@ -156,18 +157,20 @@ def main():
     info(f"[OK] Preview salvo: {prev_path}")
 
     # 8) Gráfico simples (barras) de área total por faixa
-    plt.figure(figsize=(8, 5))
-    plt.bar(g_tot["ring_id"], g_tot["area_ha"])
-    plt.ylabel("Área desmatada (ha)")
-    plt.xlabel("Faixa de distância das estradas")
-    plt.title(f"PRODES em Roraima por faixa de distância\nPeríodo: "
+    fig = Figure(figsize=(8, 5))   # direto no Agg, sem o gerenciador de figuras do pyplot
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.bar(g_tot["ring_id"], g_tot["area_ha"], rasterized=True)
+    ax.set_ylabel("Área desmatada (ha)")
+    ax.set_xlabel("Faixa de distância das estradas")
+    ax.set_title(f"PRODES em Roraima por faixa de distância\nPeríodo: "
               f"{args.year_min or int(inter[year_col].min())}–{args.year_max or int(inter[year_col].max())}"
               + (f" | Classe: {', '.join(args.class_keep)}" if args.class_keep else ""))
-    plt.xticks(rotation=0)
+    ax.tick_params(axis="x", labelrotation=0)
     fig_path = OUT_FIGS / "area_por_faixa.png"
-    plt.tight_layout()
-    plt.savefig(fig_path, dpi=160)
-    plt.close()
+    fig.tight_layout()
+    # PNG sem metadados (Software etc.) e com compressão otimizada do Pillow
+    fig.savefig(fig_path, dpi=120, metadata={"Software": None}, pil_kwargs={"optimize": True})
     info(f"[OK] Gráfico salvo: {fig_path}")
 
     # 9) Resumo no console
@@ -6,39 +6,52 @@ Pré-calcula a interseção PRODES (Roraima) × anéis de distância das estrada
 e salva em GeoParquet + agregados CSV.
 
 Entradas esperadas:
-  data/processed/deforestation_rr.shp
-  data/processed/buffers/buffer_rings.shp
+  data/processed/deforestation_rr.parquet
+  data/processed/buffers/buffer_rings.parquet
 
 Saídas:
-  data/processed/intersection/inter_prodes_rings.parquet
-  data/processed/intersection/by_ring_year.csv
-  data/processed/intersection/by_ring_total.csv
+  data/processed/intersection/inter_prodes_rings.parquet   (+ geom_map: geometria simplificada p/ o mapa)
+  data/processed/intersection/inter_prodes_rings_attrs.parquet   (com --no-geom, no lugar do anterior:
+                                                                  só ring_id/year/area_ha, Parquet comum)
+  data/processed/intersection/ring_membership.parquet     (polígono PRODES → anel, ano, área; sem geometria)
+  data/processed/intersection/by_ring_year.csv     (+ .parquet com o mesmo conteúdo)
+  data/processed/intersection/by_ring_total.csv    (+ .parquet com o mesmo conteúdo)
 
 Uso:
   python scripts/04_intersection.py
   # ou com opções:
   python scripts/04_intersection.py --max-preview 0
+  python scripts/04_intersection.py --no-geom   # só agregados (sem mapa no app, sem 07/08)
 """
 
 from pathlib import Path
 import sys
 import argparse
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
+from shapely.geometry import box
+
+from utils import empty_inter, intersect_rings, write_inter_geoparquet, write_table   # compartilhadas com 04_analyze/05/07
 
 PROJ = Path(__file__).resolve().parents[1]
 DATA_PROC = PROJ / "data" / "processed"
-RINGS_PATH = DATA_PROC / "buffers" / "buffer_rings.shp"
-PRODES_PATH = DATA_PROC / "deforestation_rr.shp"
+RINGS_PATH = DATA_PROC / "buffers" / "buffer_rings.parquet"
+PRODES_PATH = DATA_PROC / "deforestation_rr.parquet"
 
 OUT_DIR = DATA_PROC / "intersection"
 OUT_PARQUET = OUT_DIR / "inter_prodes_rings.parquet"
+OUT_ATTRS = OUT_DIR / "inter_prodes_rings_attrs.parquet"   # --no-geom: arquivo próprio, não sobrescreve o GeoParquet
+OUT_MEMBERSHIP = OUT_DIR / "ring_membership.parquet"
 OUT_BY_RING_YEAR = OUT_DIR / "by_ring_year.csv"
 OUT_BY_RING = OUT_DIR / "by_ring_total.csv"
 
 # Projeção métrica estável no Brasil
 EQUAL_AREA = "EPSG:5880"   # SIRGAS 2000 / Brazil Polyconic
 WGS84 = "EPSG:4326"
+MAP_SIMPLIFY_DEG = 0.00020  # tolerância (graus) da geometria do mapa do app
+ROW_GROUP_SIZE = 50_000     # row groups pequenos + ordem por ano => leitor Parquet descarta blocos pelo min/max
 
 def info(msg): print(f"[INFO] {msg}")
 def warn(msg): print(f"[AVISO] {msg}")
@@ -49,7 +62,10 @@ def err(msg):
 def load_gdf(path: Path, label: str) -> gpd.GeoDataFrame:
     if not path.exists():
         err(f"{label} não encontrado: {path}")
-    gdf = gpd.read_file(path)
+    if path.suffix == ".parquet":
+        gdf = gpd.read_parquet(path)   # intermediários do pipeline (01–03) em GeoParquet
+    else:
+        gdf = gpd.read_file(path, engine="pyogrio", use_arrow=True)   # pyogrio/Arrow: bem mais rápido que fiona
     if gdf.crs is None:
         gdf = gdf.set_crs(WGS84)
         warn(f"{label} sem CRS — assumindo {WGS84}.")
@@ -61,10 +77,43 @@ def find_year_col(gdf: gpd.GeoDataFrame) -> str | None:
             return c
     return None
 
+def ring_year_sums(ring_ids: np.ndarray, years: np.ndarray, area_ha: np.ndarray) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Somas anel × ano e por anel como histograma 2D: chaves viram códigos inteiros (factorize) e um
+    único np.bincount ponderado acumula a área na matriz [anel, ano] — sem hash groupby do pandas.
+    """
+    r_codes, r_uniq = pd.factorize(ring_ids, sort=True)
+    y_codes, y_uniq = pd.factorize(years, sort=True)
+    n_r, n_y = len(r_uniq), len(y_uniq)
+    flat = r_codes.astype(np.int64) * n_y + y_codes
+    acc = np.bincount(flat, weights=area_ha, minlength=n_r * n_y).reshape(n_r, n_y)
+    seen = np.bincount(flat, minlength=n_r * n_y).reshape(n_r, n_y) > 0   # só combinações existentes
+    yi, ri = np.nonzero(seen.T)   # ordem: ano, depois anel
+    by_ring_year = pd.DataFrame({"ring_id": np.asarray(r_uniq, dtype=str)[ri],
+                                 "year": np.asarray(y_uniq)[yi], "area_ha": acc[ri, yi]})
+    by_ring = (pd.DataFrame({"ring_id": np.asarray(r_uniq, dtype=str), "area_ha": acc.sum(axis=1)})
+               .sort_values("area_ha", ascending=False, ignore_index=True))
+    return by_ring_year, by_ring
+
+def write_geoparquet(inter: gpd.GeoDataFrame, year_col: str):
+    """GeoParquet 1.1 (rápido para o Streamlit; ordenado por ano p/ filtro por row group)
+    + coluna de cobertura 'bbox' (xmin/ymin/xmax/ymax) para poda espacial por row group."""
+    keep_cols = [c for c in ["ring_id", year_col, "area_ha", "geometry"] if c in inter.columns]
+    # ordem: ano, anel e curva de Hilbert — row groups compactos no espaço (estatísticas do bbox podam a leitura)
+    inter = inter[keep_cols].assign(_hilbert=inter.geometry.hilbert_distance())
+    inter = inter.sort_values([year_col, "ring_id", "_hilbert"], ignore_index=True).drop(columns="_hilbert")
+    # geometria simplificada p/ o mapa (WGS84): calculada uma vez aqui, não a cada rerun do app
+    inter["geom_map"] = inter.geometry.to_crs(WGS84).simplify(MAP_SIMPLIFY_DEG, preserve_topology=True)
+    info(f"Salvando GeoParquet: {OUT_PARQUET}")
+    write_inter_geoparquet(inter, OUT_PARQUET)
+
 def parse_args():
     ap = argparse.ArgumentParser()
     ap.add_argument("--max-preview", type=int, default=500,
                     help="Apenas informativo: nº máx. de feições para pré-visualizar durante o processamento (não salva). 0 desativa.")
+    ap.add_argument("--no-geom", action="store_true",
+                    help="Grava só ring_id/year/area_ha em inter_prodes_rings_attrs.parquet (Parquet comum, bem "
+                         "menor e mais rápido); o GeoParquet do mapa/07/08 não é gravado nem sobrescrito.")
     return ap.parse_args()
 
 def main():
@@ -75,7 +124,7 @@ def main():
     info(f"Lendo anéis: {RINGS_PATH}")
     rings = load_gdf(RINGS_PATH, "Anéis").to_crs(EQUAL_AREA)
     info(f"Lendo PRODES (RR): {PRODES_PATH}")
-    prodes = load_gdf(PRODES_PATH, "PRODES").to_crs(EQUAL_AREA)
+    prodes = load_gdf(PRODES_PATH, "PRODES").to_crs(EQUAL_AREA)   # índice = linha no arquivo (prodes_idx)
 
     # 2) Checar coluna de ano
     year_col = find_year_col(prodes)
@@ -83,45 +132,38 @@ def main():
         err("Coluna 'year' não encontrada no PRODES.")
 
     # 3) Otimização: recorte preliminar por bbox dos anéis (reduz muito)
-    bbox = unary_union(rings.geometry.values).envelope
+    #    (total_bounds sai direto dos bounds de cada anel — sem unir os polígonos só p/ pegar o envelope)
+    #    retângulo: STRtree descarta o que está fora e clip_by_rect (GEOSClipByRect) recorta o resto —
+    #    bem mais barato que a interseção genérica do gpd.clip
+    bounds = rings.total_bounds
     info("Recortando PRODES pela bounding box dos anéis…")
-    try:
-        prodes = gpd.clip(prodes, bbox)
-    except Exception:
-        # bbox é um polígono; se clip falhar, faz overlay simples
-        prodes = gpd.overlay(prodes, gpd.GeoDataFrame(geometry=[bbox], crs=rings.crs), how="intersection")
+    idx = np.sort(prodes.sindex.query(box(*bounds), predicate="intersects"))
+    prodes = prodes.iloc[idx]
+    prodes = prodes.set_geometry(gpd.GeoSeries(
+        shapely.clip_by_rect(prodes.geometry.values, *bounds), index=prodes.index, crs=prodes.crs))
+    prodes = prodes[~prodes.geometry.is_empty]
     info(f"PRODES após bbox-clip: {len(prodes)} feições")
 
     # 4) Interseção espacial PRODES × anéis
-    info("Fazendo interseção espacial (overlay)… isso pode levar alguns minutos.")
-    rings_keep = rings[["ring_id", "geometry"]].copy()
-    try:
-        inter = gpd.overlay(prodes, rings_keep, how="intersection")
-    except Exception as e:
-        warn(f"overlay padrão falhou ({e}). Tentando fallback com clip por anel (mais lento)…")
-        parts = []
-        for _, ring in rings_keep.iterrows():
-            sub = gpd.clip(prodes, ring.geometry)
-            if not sub.empty:
-                sub = sub.copy()
-                sub["ring_id"] = ring["ring_id"]
-                parts.append(sub)
-        if not parts:
-            err("Interseção resultou vazia.")
-        inter = gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=prodes.crs)
+    info("Fazendo interseção espacial (polígonos internos a cada anel passam direto)…")
+    inter = intersect_rings(prodes, rings[["ring_id", "geometry"]])
 
     if inter.empty:
         warn("Interseção vazia. Verifique se os dados se sobrepõem.")
-        # ainda assim, salvar arquivos vazios coerentes
-        gpd.GeoDataFrame(columns=["ring_id", year_col, "area_ha", "geometry"], geometry="geometry", crs=EQUAL_AREA)\
-            .to_parquet(OUT_PARQUET, index=False)
-        pd.DataFrame(columns=["ring_id", "year", "area_ha"]).to_csv(OUT_BY_RING_YEAR, index=False)
-        pd.DataFrame(columns=["ring_id", "area_ha"]).to_csv(OUT_BY_RING, index=False)
+        # ainda assim, salvar arquivos vazios coerentes (mesmo schema/opções dos arquivos cheios)
+        if args.no_geom:
+            pd.DataFrame({"ring_id": pd.Series(dtype=str), year_col: pd.Series(dtype=np.int64),
+                          "area_ha": pd.Series(dtype=float)}).to_parquet(OUT_ATTRS, index=False, compression="zstd")
+        else:
+            write_inter_geoparquet(empty_inter(year_col, EQUAL_AREA, WGS84), OUT_PARQUET)
+        write_table(pd.DataFrame({"ring_id": pd.Series(dtype=str), "year": pd.Series(dtype=np.int64),
+                                  "area_ha": pd.Series(dtype=float)}), OUT_BY_RING_YEAR)
+        write_table(pd.DataFrame({"ring_id": pd.Series(dtype=str), "area_ha": pd.Series(dtype=float)}), OUT_BY_RING)
         info("[OK] Arquivos vazios salvos (sem interseção).")
         return
 
     # 5) Área em hectares + limpeza de colunas
-    inter["area_ha"] = inter.geometry.area / 10_000.0
+    inter["area_ha"] = shapely.area(inter.geometry.values) / 10_000.0   # ufunc do shapely 2 sobre o array inteiro
 
     # Normalizar ano (int)
     try:
@@ -129,27 +171,39 @@ def main():
     except Exception:
         pass
 
-    keep_cols = [c for c in ["ring_id", year_col, "area_ha", "geometry"] if c in inter.columns]
-    inter = inter[keep_cols].copy()
-
-    # 6) Salvar GeoParquet (rápido para o Streamlit)
-    info(f"Salvando GeoParquet: {OUT_PARQUET}")
-    inter.to_parquet(OUT_PARQUET, index=False)
-
-    # 7) Agregados prontos (CSV)
-    info("Gerando agregados (CSV)…")
-    by_ring_year = (
-        inter.groupby(["ring_id", year_col])["area_ha"]
-        .sum().reset_index().sort_values([year_col, "ring_id"])
-        .rename(columns={year_col: "year"})
-    )
-    by_ring = (
-        inter.groupby(["ring_id"])["area_ha"]
-        .sum().reset_index().sort_values("area_ha", ascending=False)
-    )
-
-    by_ring_year.to_csv(OUT_BY_RING_YEAR, index=False, encoding="utf-8")
-    by_ring.to_csv(OUT_BY_RING, index=False, encoding="utf-8")
+    # 6) Salvar
+    if args.no_geom:
+        # só atributos: nada de Hilbert, geom_map nem WKB no disco
+        slim_out = pd.DataFrame({"ring_id": inter["ring_id"].to_numpy(), year_col: inter[year_col].to_numpy(),
+                                 "area_ha": inter["area_ha"].to_numpy()})
+        slim_out = slim_out.sort_values([year_col, "ring_id"], ignore_index=True)
+        info(f"Salvando Parquet (sem geometria): {OUT_ATTRS}")
+        slim_out.to_parquet(OUT_ATTRS, index=False, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+    else:
+        # prodes_idx/inside são só da tabela de pertinência (6b), não do GeoParquet do mapa
+        write_geoparquet(inter.drop(columns=["prodes_idx", "inside"]), year_col)
+
+    # 6b) Pertinência polígono → anel (layout colunar, sem geometria): reagregações futuras com outros
+    #     filtros de ano/classe viram só filtro + groupby nesse Parquet, sem nenhuma operação do GEOS
+    attrs = [c for c in ["main_class"] if c in inter.columns]
+    membership = pd.DataFrame({
+        "prodes_idx": inter["prodes_idx"].to_numpy(),
+        "ring_id": pd.Categorical(inter["ring_id"].to_numpy()),
+        "year": inter[year_col].to_numpy().astype(np.int16),
+        "area_ha": inter["area_ha"].to_numpy(),
+        "inside": inter["inside"].to_numpy(),
+        **{c: inter[c].to_numpy() for c in attrs},
+    })
+    membership.to_parquet(OUT_MEMBERSHIP, index=False, compression="zstd")
+    info(f"[OK] {OUT_MEMBERSHIP} ({int(membership['inside'].sum())}/{len(membership)} polígonos inteiros no anel)")
+
+    # 7) Agregados prontos (CSV + Parquet)
+    info("Gerando agregados (CSV + Parquet)…")
+    by_ring_year, by_ring = ring_year_sums(inter["ring_id"].to_numpy(), inter[year_col].to_numpy(),
+                                           inter["area_ha"].to_numpy())
+
+    write_table(by_ring_year, OUT_BY_RING_YEAR)
+    write_table(by_ring, OUT_BY_RING)
     info(f"[OK] {OUT_BY_RING_YEAR}")
     info(f"[OK] {OUT_BY_RING}")
 
@@ -4,76 +4,169 @@
 05_precompute_intersections.py
 Pré-calcula PRODES ∩ anéis (Roraima) e salva em Parquet + agregados CSV.
 
+Uso:
+  python scripts/05_precompute_intersections.py                   # shapely (STRtree em lote)
+  python scripts/05_precompute_intersections.py --engine duckdb   # extensão spatial do DuckDB
+
 Saídas:
-  data/processed/intersection/inter_prodes_rings.parquet
-  data/processed/intersection/by_ring_year.csv
-  data/processed/intersection/by_ring_total.csv
+  data/processed/intersection/inter_prodes_rings.parquet   (+ geom_map: geometria simplificada p/ o mapa)
+  data/processed/intersection/by_ring_year.csv     (+ .parquet com o mesmo conteúdo)
+  data/processed/intersection/by_ring_total.csv    (+ .parquet com o mesmo conteúdo)
 """
 
 from pathlib import Path
+import argparse
 import geopandas as gpd
+import duckdb
+import numpy as np
 import pandas as pd
-from shapely.ops import unary_union   # corrigindo depreciação
-from shapely.validation import make_valid
+import pyarrow.parquet as pq
+import shapely
+
+from utils import (INTER_CHUNK_SIZE, WORKERS, empty_inter, intersect_rings, sql_str, threaded,
+                   write_inter_geoparquet, write_table)   # compartilhadas com 04/06/07
 from shapely.geometry import Polygon, MultiPolygon
 
 PROJ = Path(__file__).resolve().parents[1]
 PROC = PROJ / "data" / "processed"
 OUTD = PROC / "intersection"
 OUTD.mkdir(parents=True, exist_ok=True)
+RINGS_PATH = PROC / "buffers" / "buffer_rings.parquet"
+PRODES_PATH = PROC / "deforestation_rr.parquet"
+CACHE_DIR = OUTD / "cache"   # entradas já saneadas (_fix_geoms), reaproveitadas enquanto a origem não mudar
 
 EQUAL_AREA = "EPSG:5880"
 WGS84 = "EPSG:4326"
+MAP_SIMPLIFY_DEG = 0.00020   # tolerância (graus) da geometria do mapa do app
 
 def _fix_geoms(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """Conserta geometrias inválidas e mantém apenas polígonos."""
-    gdf = gdf.copy()
-    # 1) tornar válidas
-    gdf["geometry"] = gdf.geometry.apply(lambda g: make_valid(g) if g is not None else None)
-    # 2) explodir coleções (MultiPolygon, GeometryCollection) em peças individuais
-    gdf = gdf.explode(index_parts=False, ignore_index=True)
-    # 3) filtrar só Polygon/MultiPolygon (após explode deve ser Polygon; mas deixo seguro)
-    gdf = gdf[gdf.geometry.notnull()]
-    gdf = gdf[gdf.geometry.geom_type.isin(["Polygon", "MultiPolygon"])]
-    # 4) se ainda houver MultiPolygon, explode de novo
-    if (gdf.geometry.geom_type == "MultiPolygon").any():
-        gdf = gdf.explode(index_parts=False, ignore_index=True)
-        gdf = gdf[gdf.geometry.geom_type == "Polygon"]
-    gdf = gdf.reset_index(drop=True)
+    # 1) tornar válidas — make_valid (caro) só nas inválidas, vetorizado, sem .apply por linha
+    geoms = gdf.geometry.values.copy()
+    bad = ~shapely.is_valid(geoms) & ~shapely.is_missing(geoms)
+    if bad.any():
+        geoms[bad] = shapely.make_valid(geoms[bad])
+    # 2) explodir coleções em peças atômicas com shapely.get_parts (uma passada no GEOS por nível:
+    #    GeometryCollection -> MultiPolygon -> Polygon) e repetir os atributos pelo índice de origem
+    parts, src = shapely.get_parts(geoms, return_index=True)
+    parts, sub = shapely.get_parts(parts, return_index=True)
+    src = src[sub]
+    # 3) só polígonos (type id 3): linhas/pontos de make_valid ficam de fora
+    is_poly = shapely.get_type_id(parts) == 3
+    out = gdf.drop(columns=gdf.geometry.name).iloc[src[is_poly]].reset_index(drop=True)
+    return gpd.GeoDataFrame(out, geometry=parts[is_poly], crs=gdf.crs)
+
+def _cached(src: Path, name: str, build) -> gpd.GeoDataFrame:
+    """GeoParquet em CACHE_DIR/name se for mais novo que `src`; senão roda build() e grava o cache."""
+    cache = CACHE_DIR / name
+    if cache.exists() and cache.stat().st_mtime >= src.stat().st_mtime:
+        print(f"[INFO] Cache: {cache}")
+        return gpd.read_parquet(cache)
+    gdf = build()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    gdf.to_parquet(cache, index=False, compression="zstd")
     return gdf
 
-# ---------- carregar ----------
-rings = gpd.read_file(PROC / "buffers" / "buffer_rings.shp").to_crs(EQUAL_AREA)[["ring_id","geometry"]]
-prodes = gpd.read_file(PROC / "deforestation_rr.shp").to_crs(EQUAL_AREA)
+def _intersect_shapely(year_col: str) -> gpd.GeoDataFrame:
+    """Caminho padrão: saneia as camadas e cruza o PRODES (em lotes) com o STRtree dos anéis."""
+    # ---------- carregar + sanear geometrias (com cache: reexecuções pulam leitura e make_valid) ----------
+    # dos anéis só o ring_id. _fix_geoms explode os anéis em polígonos soltos: junta de volta num
+    # (Multi)Polygon por ring_id — menos folhas no STRtree e menos pares (a soma de área por anel não muda)
+    rings = _cached(RINGS_PATH, "rings_fixed_5880.parquet", lambda: _fix_geoms(
+        gpd.read_parquet(RINGS_PATH, columns=["ring_id", "geometry"]).to_crs(EQUAL_AREA)
+    ).dissolve(by="ring_id", as_index=False)[["ring_id", "geometry"]])
+    prodes = _cached(PRODES_PATH, f"prodes_fixed_5880_{year_col}.parquet", lambda: _fix_geoms(
+        gpd.read_parquet(PRODES_PATH, columns=[year_col, "geometry"]).to_crs(EQUAL_AREA)))
 
-# ---------- sanear geometrias ----------
-rings = _fix_geoms(rings)
-prodes = _fix_geoms(prodes)
+    # ---------- pré-filtro por bbox (só aritmética de envelopes, sem recortar geometria) ----------
+    # envelope dos anéis por redução numpy dos bounds de cada um (sem unir as geometrias no GEOS)
+    rb = shapely.bounds(rings.geometry.values)
+    minx, miny = rb[:, 0].min(), rb[:, 1].min()
+    maxx, maxy = rb[:, 2].max(), rb[:, 3].max()
+    bx = shapely.bounds(prodes.geometry.values)
+    keep_bb = (bx[:, 2] >= minx) & (bx[:, 0] <= maxx) & (bx[:, 3] >= miny) & (bx[:, 1] <= maxy)
+    prodes = prodes[keep_bb].reset_index(drop=True)
+    # ordem de Hilbert do PRODES: cada lote de INTER_CHUNK_SIZE fica espacialmente compacto, então suas
+    # consultas à árvore caem nos mesmos nós/anéis (a saída é reordenada por ano/anel/Hilbert no fim)
+    if len(prodes):
+        prodes = prodes.iloc[np.argsort(prodes.geometry.hilbert_distance().to_numpy(), kind="stable")]
+        prodes = prodes.reset_index(drop=True)
 
-# ---------- bbox clip para acelerar ----------
-bbox = unary_union(rings.geometry).envelope
-prodes = gpd.clip(prodes, bbox)
+    # ---------- interseção (STRtree em lote + ufunc do shapely 2, sem gpd.overlay) ----------
+    # mesmo motor de 04 (utils.intersect_rings): árvore dos anéis montada uma vez e PRODES em fatias
+    print(f"[INFO] Interseção de {len(prodes)} polígonos PRODES em lotes de {INTER_CHUNK_SIZE}…")
+    return intersect_rings(prodes, rings)
 
-# ---------- overlay (interseção) ----------
-# Obs.: agora 'prodes' contém apenas POLYGON -> não dá mais o erro de mixed types
-inter = gpd.overlay(prodes, rings, how="intersection", keep_geom_type=True)
+def _intersect_duckdb(prodes_path: Path, rings_path: Path, year_col: str) -> gpd.GeoDataFrame:
+    """
+    Alternativa (--engine duckdb): a junção inteira numa consulta da extensão spatial do DuckDB
+    (junção espacial do próprio otimizador sobre ST_Intersects, multi-thread); devolve o mesmo
+    formato de _intersect_shapely.
+    Requer a extensão spatial (baixada pelo INSTALL na primeira vez).
+    """
+    con = duckdb.connect()
+    try:
+        try:
+            con.execute("INSTALL spatial; LOAD spatial;")
+        except duckdb.Error as e:
+            raise RuntimeError(f"Extensão spatial do DuckDB indisponível ({e}). Rode com --engine shapely.")
+        try:   # geometria dos GeoParquet como WKB (BLOB), sem a conversão automática das versões novas
+            con.execute("SET enable_geoparquet_conversion = false;")
+        except duckdb.Error:
+            pass
+        con.execute(f"SET threads = {WORKERS};")
+        con.execute("""
+            CREATE TABLE rings AS
+            SELECT CAST(ring_id AS VARCHAR) AS ring_id, ST_MakeValid(ST_GeomFromWKB(geometry)) AS g
+            FROM read_parquet(?);
+        """, [rings_path.as_posix()])
+        # polígono inteiro dentro do anel entra como está; só os que cruzam a borda passam pelo ST_Intersection
+        tbl = con.execute(f"""
+            SELECT p.year AS "{year_col}", r.ring_id,
+                   ST_AsWKB(ST_CollectionExtract(
+                       CASE WHEN ST_Within(p.g, r.g) THEN p.g ELSE ST_Intersection(p.g, r.g) END, 3)) AS wkb
+            FROM (SELECT "{year_col}" AS year, ST_MakeValid(ST_GeomFromWKB(geometry)) AS g
+                  FROM read_parquet(?)) p
+            JOIN rings r ON ST_Intersects(p.g, r.g);
+        """, [prodes_path.as_posix()]).fetch_arrow_table()
+    finally:
+        con.close()
+    geoms = shapely.from_wkb(tbl.column("wkb").to_numpy(zero_copy_only=False))
+    inter = gpd.GeoDataFrame(tbl.drop(["wkb"]).to_pandas(), geometry=geoms, crs=EQUAL_AREA)
+    return inter[~shapely.is_empty(inter.geometry.values)].reset_index(drop=True)
+
+# ---------- argumentos ----------
+ap = argparse.ArgumentParser(description="PRODES ∩ anéis -> GeoParquet + agregados")
+ap.add_argument("--engine", choices=["shapely", "duckdb"], default="shapely",
+                help="Motor da interseção: shapely (STRtree, padrão) ou duckdb (extensão spatial).")
+args = ap.parse_args()
+
+# ---------- carregar ----------
+# intermediários em GeoParquet (01–03), já em EPSG:5880
+# do PRODES só ano + geometria (o schema vem do footer): os demais atributos nem são lidos, e não
+# atravessam interseção, ordenação e agregação
+year_col = next((c for c in pq.ParquetFile(PRODES_PATH).schema_arrow.names if c.lower()=="year"), None)
+if year_col is None:
+    raise RuntimeError("Coluna 'year' não encontrada no PRODES recortado.")
+
+if args.engine == "duckdb":
+    print("[INFO] Interseção no DuckDB (extensão spatial)…")
+    inter = _intersect_duckdb(PRODES_PATH, RINGS_PATH, year_col)
+else:
+    inter = _intersect_shapely(year_col)
 
 if inter.empty:
-    # salvar arquivos vazios coerentes
+    # salvar arquivos vazios coerentes (mesmo schema/opções do GeoParquet cheio)
     parquet_path = OUTD / "inter_prodes_rings.parquet"
-    gpd.GeoDataFrame(columns=["ring_id","year","area_ha","geometry"], geometry="geometry", crs=EQUAL_AREA)\
-        .to_parquet(parquet_path, index=False)
-    pd.DataFrame(columns=["ring_id","year","area_ha"]).to_csv(OUTD / "by_ring_year.csv", index=False)
-    pd.DataFrame(columns=["ring_id","area_ha"]).to_csv(OUTD / "by_ring_total.csv", index=False)
+    write_inter_geoparquet(empty_inter(year_col, EQUAL_AREA, WGS84), parquet_path)
+    write_table(pd.DataFrame({"ring_id": pd.Series(dtype=str), "year": pd.Series(dtype="int64"),
+                              "area_ha": pd.Series(dtype=float)}), OUTD / "by_ring_year.csv")
+    write_table(pd.DataFrame({"ring_id": pd.Series(dtype=str), "area_ha": pd.Series(dtype=float)}),
+                OUTD / "by_ring_total.csv")
     print("[AVISO] Interseção vazia. Arquivos vazios salvos em", OUTD)
 else:
     # ---------- área (ha) e limpeza ----------
-    # coluna 'year'
-    year_col = next((c for c in inter.columns if c.lower()=="year"), None)
-    if year_col is None:
-        raise RuntimeError("Coluna 'year' não encontrada no PRODES recortado.")
-
-    inter["area_ha"] = inter.geometry.area / 10_000.0
+    inter["area_ha"] = threaded(shapely.area, inter.geometry.values) / 10_000.0
     # normaliza ano (int)
     try:
         inter[year_col] = inter[year_col].astype(float).round().astype(int)
@@ -81,20 +174,38 @@ else:
         pass
 
     keep = ["ring_id", year_col, "area_ha", "geometry"]
-    inter = inter[keep].copy()
+    # ordem: ano, anel e curva de Hilbert — row groups compactos no espaço (estatísticas do bbox podam a leitura)
+    inter = inter[keep].assign(_hilbert=inter.geometry.hilbert_distance())
+    inter = inter.sort_values([year_col, "ring_id", "_hilbert"], ignore_index=True).drop(columns="_hilbert")
+    # geometria simplificada p/ o mapa (WGS84): calculada uma vez aqui, não a cada rerun do app
+    inter["geom_map"] = inter.geometry.to_crs(WGS84).simplify(MAP_SIMPLIFY_DEG, preserve_topology=True)
 
-    # ---------- salvar parquet (GeoParquet) ----------
+    # ---------- salvar parquet (GeoParquet 1.1, com coluna de cobertura 'bbox') ----------
+    # arquivo único (app, 06, 07 e 08 leem esse caminho): a ordem por ano + row groups pequenos já
+    # dão poda por ano (min/max da coluna) e a coluna bbox dá poda espacial por row group
     parquet_path = OUTD / "inter_prodes_rings.parquet"
-    inter.to_parquet(parquet_path, index=False)
+    write_inter_geoparquet(inter, parquet_path)
     print("[OK]", parquet_path)
 
-    # ---------- agregados ----------
-    by_ring_year = (inter.groupby(["ring_id", year_col])["area_ha"].sum()
-                    .reset_index().sort_values([year_col,"ring_id"])
-                    .rename(columns={year_col: "year"}))
-    by_ring = (inter.groupby(["ring_id"])["area_ha"].sum()
-               .reset_index().sort_values("area_ha", ascending=False))
-
-    by_ring_year.to_csv(OUTD / "by_ring_year.csv", index=False)
-    by_ring.to_csv(OUTD / "by_ring_total.csv", index=False)
-    print("[OK] agregados CSV salvos em", OUTD)
+    # ---------- agregados (DuckDB direto no Parquet recém-gravado) ----------
+    # agregação paralela do DuckDB lendo só ring_id/ano/área (projeção no Parquet);
+    # a GeoDataFrame da interseção não precisa mais ficar em memória
+    del inter
+    con = duckdb.connect()
+    try:
+        con.execute(f"""
+            CREATE TABLE by_ring_year AS
+            SELECT CAST(ring_id AS VARCHAR) AS ring_id, "{year_col}" AS year, SUM(area_ha) AS area_ha
+            FROM read_parquet(?) GROUP BY 1, 2 ORDER BY 2, 1
+        """, [parquet_path.as_posix()])
+        con.execute("""
+            CREATE TABLE by_ring AS
+            SELECT ring_id, SUM(area_ha) AS area_ha FROM by_ring_year GROUP BY 1 ORDER BY 2 DESC
+        """)
+        # Parquet (zstd, ring_id em dicionário) é o formato lido pelo 06; o CSV fica como exportação legível
+        for table, stem in (("by_ring_year", "by_ring_year"), ("by_ring", "by_ring_total")):
+            con.execute(f"COPY {table} TO {sql_str(OUTD / f'{stem}.parquet')} (FORMAT PARQUET, COMPRESSION zstd);")
+            con.execute(f"COPY {table} TO {sql_str(OUTD / f'{stem}.csv')} (FORMAT CSV, HEADER);")
+    finally:
+        con.close()
+    print("[OK] agregados CSV + Parquet salvos em", OUTD)
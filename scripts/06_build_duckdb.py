@@ -9,49 +9,108 @@ Requisitos: pip install duckdb
 from pathlib import Path
 import duckdb
 
+from utils import sql_str   # compartilhada com 05
+
 PROJ = Path(__file__).resolve().parents[1]
 INTER_DIR = PROJ / "data" / "processed" / "intersection"
 PARQUET_PATH = INTER_DIR / "inter_prodes_rings.parquet"
+ATTRS_PATH = INTER_DIR / "inter_prodes_rings_attrs.parquet"   # 04_intersection.py --no-geom (sem geometria)
 CSV_RING_YEAR = INTER_DIR / "by_ring_year.csv"
 CSV_RING = INTER_DIR / "by_ring_total.csv"
 DB_PATH = INTER_DIR / "intersections.duckdb"
 
-if not PARQUET_PATH.exists():
+# fonte = o mais novo entre o GeoParquet e o Parquet de atributos (04 --no-geom: mesmas colunas
+# ring_id/year/area_ha, sem geometria) — um 04 --no-geom posterior não deixa o banco no GeoParquet antigo
+sources = [p for p in (PARQUET_PATH, ATTRS_PATH) if p.exists()]
+if not sources:
     raise FileNotFoundError(f"GeoParquet não encontrado: {PARQUET_PATH}\nRode antes: python scripts/05_precompute_intersections.py")
+PARQUET_PATH = max(sources, key=lambda p: p.stat().st_mtime)
 
 con = duckdb.connect(DB_PATH.as_posix())
 
 # Tabela principal (lendo direto do parquet)
-con.execute(f"CREATE OR REPLACE VIEW inter AS SELECT * FROM read_parquet('{PARQUET_PATH.as_posix()}');")
-
-# Descobre coluna de ano para normalizar
-year_col = con.execute("PRAGMA table_info('inter');").fetchdf()
-year_col = year_col.loc[year_col['name'].str.lower().eq('year'), 'name'].iloc[0]
-
-# Materializa agregados
-con.execute(f"""
-CREATE OR REPLACE TABLE by_ring_year AS
-SELECT CAST(ring_id AS VARCHAR) AS ring_id,
-       CAST({year_col} AS INT) AS year,
-       SUM(area_ha) AS area_ha
-FROM inter
-GROUP BY 1,2
-ORDER BY 2,1;
-""")
-
-con.execute("""
-CREATE OR REPLACE TABLE by_ring AS
-SELECT ring_id, SUM(area_ha) AS area_ha
-FROM by_ring_year
-GROUP BY 1
-ORDER BY ring_id;
-""")
-
-# (Opcional) também guarda os CSVs como tabelas, se quiser comparar
-if CSV_RING_YEAR.exists():
-    con.execute(f"CREATE OR REPLACE TABLE by_ring_year_csv AS SELECT * FROM read_csv_auto('{CSV_RING_YEAR.as_posix()}');")
-if CSV_RING.exists():
-    con.execute(f"CREATE OR REPLACE TABLE by_ring_csv AS SELECT * FROM read_csv_auto('{CSV_RING.as_posix()}');")
+con.execute(f"CREATE OR REPLACE VIEW inter AS SELECT * FROM read_parquet({sql_str(PARQUET_PATH)});")
+
+# Descobre coluna de ano para normalizar (nomes direto do catálogo, sem montar DataFrame)
+names = [r[0] for r in con.execute("SELECT name FROM pragma_table_info('inter');").fetchall()]
+lower = {c.lower(): c for c in names}
+year_col = lower["year"]
+has_mun = "MUN_NAME" in names   # coluna gravada por scripts/07_tag_muni.py
+
+# Visão sem geometria (ring_id, year, area_ha [, MUN_NAME]) — consultas do app sem decodificar WKB;
+# MUN_NAME aparece depois de rodar scripts/07_tag_muni.py (a view é re-resolvida a cada consulta)
+geom_cols = [c for c in ("geometry", "geom_map", "bbox") if c in names]
+rename = f' RENAME ("{year_col}" AS year)' if year_col != "year" else ""
+exclude = f" EXCLUDE ({', '.join(geom_cols)})" if geom_cols else ""   # 04 --no-geom: Parquet de atributos, já sem geometria
+con.execute(f"CREATE OR REPLACE VIEW inter_nogeom AS SELECT *{exclude}{rename} FROM inter;")
+
+# Agregados materializados só são refeitos quando o GeoParquet muda (mtime guardado em _build_info);
+# com o Parquet inalterado o build não relê a interseção
+mtime = PARQUET_PATH.stat().st_mtime
+con.execute("CREATE TABLE IF NOT EXISTS _build_info (mtime DOUBLE);")
+prev = con.execute("SELECT mtime FROM _build_info;").fetchone()
+tables = {r[0] for r in con.execute("SELECT table_name FROM duckdb_tables();").fetchall()}
+needed = {"by_ring_year", "by_ring"} | ({"by_muni_ring_year"} if has_mun else set())
+if prev is not None and prev[0] == mtime and needed <= tables:
+    print(f"[OK] {PARQUET_PATH.name} inalterado desde o último build — agregados mantidos.")
+else:
+    # Uma única leitura da interseção: agrega em tabela temporária (ring_id ainda VARCHAR; com MUN_NAME
+    # de 07, já por município) e tira dela os valores do ENUM e todos os agregados — nada de outro scan
+    mun = "CAST(MUN_NAME AS VARCHAR) AS MUN_NAME, " if has_mun else ""
+    con.execute(f"""
+    CREATE OR REPLACE TEMP TABLE _agg AS
+    SELECT {mun}CAST(ring_id AS VARCHAR) AS ring_id,
+           CAST("{year_col}" AS SMALLINT) AS year,
+           SUM(area_ha) AS area_ha
+    FROM inter
+    GROUP BY ALL;
+    """)
+    # Materializa agregados — ring_id como ENUM (código inteiro: hash/comparação sem string; a ordem do
+    # ENUM é a alfabética, a mesma do VARCHAR) e ano como SMALLINT. O tipo é recriado a cada build,
+    # então as tabelas que dependem dele saem antes.
+    # by_muni_ring_year sai sempre: sem MUN_NAME no Parquet (04/05 regravaram sem 07) ficaria defasada
+    con.execute("DROP TABLE IF EXISTS by_ring; DROP TABLE IF EXISTS by_ring_year; "
+                "DROP TABLE IF EXISTS by_muni_ring_year; DROP TYPE IF EXISTS ring_t;")
+    con.execute("CREATE TYPE ring_t AS ENUM (SELECT DISTINCT ring_id FROM _agg WHERE ring_id IS NOT NULL ORDER BY 1);")
+    con.execute("""
+    CREATE OR REPLACE TABLE by_ring_year AS
+    SELECT CAST(ring_id AS ring_t) AS ring_id, year, SUM(area_ha) AS area_ha
+    FROM _agg
+    GROUP BY 1,2
+    ORDER BY 2,1;
+    """)
+    if has_mun:
+        # município × faixa × ano (filtro por município no app/relatório); feições fora de
+        # qualquer município (MUN_NAME nulo) ficam de fora. ring_id fica VARCHAR aqui: app/doc filtram e
+        # agrupam essa tabela como texto (ENUM voltaria ao pandas como Categorical)
+        con.execute("""
+        CREATE OR REPLACE TABLE by_muni_ring_year AS
+        SELECT MUN_NAME, ring_id, year, area_ha
+        FROM _agg
+        WHERE MUN_NAME IS NOT NULL
+        ORDER BY 1,3,2;
+        """)
+
+    con.execute("""
+    CREATE OR REPLACE TABLE by_ring AS
+    SELECT ring_id, SUM(area_ha) AS area_ha
+    FROM by_ring_year
+    GROUP BY 1
+    ORDER BY ring_id;
+    """)
+
+    con.execute("DROP TABLE _agg;")
+    con.execute("DELETE FROM _build_info;")
+    con.execute("INSERT INTO _build_info VALUES (?);", [mtime])
+
+# (Opcional) também guarda os agregados de 04/05 como tabelas, se quiser comparar;
+# prefere o .parquet gravado ao lado do CSV (tipado, sem inferência do read_csv_auto)
+for table, csv in (("by_ring_year_csv", CSV_RING_YEAR), ("by_ring_csv", CSV_RING)):
+    pq_path = csv.with_suffix(".parquet")
+    if pq_path.exists():
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM read_parquet(?);", [pq_path.as_posix()])
+    elif csv.exists():
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM read_csv_auto(?);", [csv.as_posix()])
 
 con.close()
-print("[OK] DuckDB criado em:", DB_PATH)
+print(f"[OK] DuckDB criado em: {DB_PATH} (fonte: {PARQUET_PATH.name})")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+07_tag_muni.py
+Associa cada feição de PRODES ∩ anéis a um município (IBGE), grava a coluna MUN_NAME
+no próprio GeoParquet e refaz o DuckDB (06_build_duckdb.py), que passa a ter o agregado
+município × faixa × ano — assim o app não precisa de sjoin por rerun (filtro vira um
+simples .isin()).
+
+Entradas esperadas:
+  data/processed/intersection/inter_prodes_rings.parquet
+  data/external/ibge_municipal/RR_Municipios_2024.shp
+
+Saídas:
+  data/processed/intersection/inter_prodes_rings.parquet   (+ coluna MUN_NAME)
+  data/external/ibge_municipal/RR_Municipios.parquet       (MUN_NAME + geometry, WGS84 — lido pelo app)
+  data/processed/intersection/intersections.duckdb         (via 06: + by_muni_ring_year)
+
+Obs.: rodar de novo sempre que 04/05 regravarem o GeoParquet.
+
+Uso:
+  python scripts/07_tag_muni.py
+"""
+
+from pathlib import Path
+import sys
+import runpy
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from utils import write_inter_geoparquet   # mesmas opções de gravação de 04/05 (1.1, zstd, bbox)
+
+PROJ = Path(__file__).resolve().parents[1]
+DATA = PROJ / "data"
+INTER_DIR = DATA / "processed" / "intersection"
+PARQUET_PATH = INTER_DIR / "inter_prodes_rings.parquet"
+BUILD_DUCKDB = Path(__file__).with_name("06_build_duckdb.py")
+MUN_PATH = DATA / "external" / "ibge_municipal" / "RR_Municipios_2024.shp"
+MUN_PARQUET = MUN_PATH.with_name("RR_Municipios.parquet")
+
+EQUAL_AREA = "EPSG:5880"   # SIRGAS 2000 / Brazil Polyconic
+WGS84 = "EPSG:4326"
+
+MUN_NAME_CANDS = ["NM_MUN", "NM_MUNICIP", "NM_MUNICIPIO", "NOME_MUN", "NM_MUN_2024", "name"]
+
+def info(msg): print(f"[INFO] {msg}")
+def warn(msg): print(f"[AVISO] {msg}")
+def err(msg):
+    print(f"[ERRO] {msg}", file=sys.stderr)
+    sys.exit(1)
+
+def load_municipios(path: Path) -> gpd.GeoDataFrame:
+    """Municípios limpos (MUN_NAME + geometry), no CRS original do shapefile."""
+    if not path.exists():
+        err(f"Shapefile de municípios não encontrado: {path}")
+    gdf = gpd.read_file(path, engine="pyogrio")
+    if gdf.crs is None:
+        gdf = gdf.set_crs(WGS84)
+        warn(f"Municípios sem CRS — assumindo {WGS84}.")
+    name_col = next((c for c in MUN_NAME_CANDS if c in gdf.columns), None)
+    if name_col is None:
+        gdf["MUN_NAME"] = gdf.index.astype(str)
+        name_col = "MUN_NAME"
+    gdf = gdf.rename(columns={name_col: "MUN_NAME"})
+    gdf["MUN_NAME"] = gdf["MUN_NAME"].astype(str)
+    return gdf[["MUN_NAME", "geometry"]]
+
+def tag_municipios(inter: gpd.GeoDataFrame, mun: gpd.GeoDataFrame) -> pd.Series:
+    """
+    Atribui UM município a cada feição, pelo ponto representativo (sempre dentro do polígono).
+    Evita contar duas vezes feições que cruzam a divisa municipal.
+    Consulta em lote no STRtree dos municípios (predicados vetorizados do shapely 2), sem sjoin.
+    """
+    pts = shapely.point_on_surface(inter.geometry.values)
+    left, right = mun.sindex.query(pts, predicate="within")
+    # ponto exatamente na divisa casa com 2 municípios: fica com o primeiro
+    left, first = np.unique(left, return_index=True)
+    names = np.full(len(inter), None, dtype=object)
+    names[left] = mun["MUN_NAME"].to_numpy()[right[first]]
+    return pd.Series(names, index=inter.index, name="MUN_NAME")
+
+def main():
+    if not PARQUET_PATH.exists():
+        err(f"GeoParquet não encontrado: {PARQUET_PATH}\nRode antes: python scripts/05_precompute_intersections.py")
+
+    info(f"Lendo interseção: {PARQUET_PATH}")
+    inter = gpd.read_parquet(PARQUET_PATH)
+    inter = inter.drop(columns=["MUN_NAME", "bbox"], errors="ignore")  # re-execução; bbox é regravado abaixo
+    # 04/05 já gravam em EPSG:5880: nada de reprojetar a interseção inteira a cada execução
+    if inter.crs is None or inter.crs.to_string().upper() != EQUAL_AREA:
+        err(f"GeoParquet em {inter.crs}, esperado {EQUAL_AREA}. Rode de novo: python scripts/05_precompute_intersections.py")
+
+    year_col = next((c for c in inter.columns if c.lower() == "year"), None)
+    if year_col is None:
+        err("Coluna 'year' não encontrada no GeoParquet.")
+
+    info(f"Lendo municípios: {MUN_PATH}")
+    mun = load_municipios(MUN_PATH)
+    # camada limpa em GeoParquet p/ o app (evita o driver de shapefile a cada start)
+    mun.to_crs(WGS84).to_parquet(MUN_PARQUET, index=False)
+    info(f"[OK] Municípios (GeoParquet): {MUN_PARQUET}")
+    mun = mun.to_crs(EQUAL_AREA)
+
+    info("Associando feições a municípios (ponto representativo)…")
+    mun_name = tag_municipios(inter, mun)
+    n_sem = int(mun_name.isna().sum())
+    if n_sem:
+        warn(f"{n_sem} feições fora de qualquer município (ignoradas no agregado).")
+
+    # grava MUN_NAME por feição no GeoParquet (filtro do mapa no app)
+    inter["MUN_NAME"] = mun_name
+    write_inter_geoparquet(inter, PARQUET_PATH)   # ordem ano/anel/Hilbert de 04/05 preservada
+    info(f"[OK] MUN_NAME gravado em: {PARQUET_PATH}")
+
+    # agregados (inclusive by_muni_ring_year) e o mtime em _build_info ficam a cargo do 06: o
+    # GeoParquet acabou de mudar, então ele refaz tudo numa leitura só
+    info("Atualizando o DuckDB (06_build_duckdb.py)…")
+    runpy.run_path(str(BUILD_DUCKDB), run_name="__main__")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+08_build_pmtiles.py
+Gera tiles vetoriais (PMTiles) da interseção PRODES × anéis para o mapa do app:
+o navegador baixa só os tiles visíveis em vez de um GeoJSON com todos os polígonos.
+
+Requer tippecanoe (>= 2.17, com saída .pmtiles) no PATH:
+  https://github.com/felt/tippecanoe
+
+Entradas esperadas:
+  data/processed/intersection/inter_prodes_rings.parquet   (de preferência já com MUN_NAME — 07_tag_muni.py)
+
+Saídas:
+  static/inter.pmtiles   (servido pelo Streamlit em /app/static/inter.pmtiles; ver .streamlit/config.toml)
+
+Uso:
+  python scripts/08_build_pmtiles.py
+"""
+
+from pathlib import Path
+import sys
+import shutil
+import subprocess
+import tempfile
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+PROJ = Path(__file__).resolve().parents[1]
+PARQUET_PATH = PROJ / "data" / "processed" / "intersection" / "inter_prodes_rings.parquet"
+OUT_DIR = PROJ / "static"
+OUT_PMTILES = OUT_DIR / "inter.pmtiles"
+LAYER = "inter"   # nome da camada lido pelo app (dataLayer)
+
+WGS84 = "EPSG:4326"
+
+def info(msg): print(f"[INFO] {msg}")
+def warn(msg): print(f"[AVISO] {msg}")
+def err(msg):
+    print(f"[ERRO] {msg}", file=sys.stderr)
+    sys.exit(1)
+
+def main():
+    tippecanoe = shutil.which("tippecanoe")
+    if tippecanoe is None:
+        err("tippecanoe não encontrado no PATH (https://github.com/felt/tippecanoe).")
+    if not PARQUET_PATH.exists():
+        err(f"GeoParquet não encontrado: {PARQUET_PATH}\nRode antes: python scripts/05_precompute_intersections.py")
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    info(f"Lendo interseção: {PARQUET_PATH}")
+    # só o schema (metadados do footer) p/ escolher colunas; geom_map/bbox nunca são descomprimidas
+    names = pq.ParquetFile(PARQUET_PATH).schema_arrow.names
+    year_col = next((c for c in names if c.lower() == "year"), None)
+    if year_col is None:
+        err("Coluna 'year' não encontrada no GeoParquet.")
+    if "MUN_NAME" not in names:
+        warn("GeoParquet sem MUN_NAME — filtro por município não se aplicará aos tiles (rode 07_tag_muni.py).")
+    keep = [c for c in ["ring_id", year_col, "area_ha", "MUN_NAME", "geometry"] if c in names]
+    inter = gpd.read_parquet(PARQUET_PATH, columns=keep)
+    inter = inter.rename(columns={year_col: "year"}).to_crs(WGS84)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seq = Path(tmp) / "inter.geojsonl"
+        info(f"Exportando GeoJSONSeq temporário ({len(inter)} feições)…")
+        inter.to_file(seq, driver="GeoJSONSeq")
+
+        # sem descarte de feições por tile (o app promete "sem amostragem"): tiles maiores, mapa completo
+        cmd = [tippecanoe, "-o", OUT_PMTILES.as_posix(), "-zg", "--no-feature-limit", "--no-tile-size-limit",
+               "-l", LAYER, "--force", seq.as_posix()]
+        info("Gerando PMTiles: " + " ".join(cmd))
+        subprocess.run(cmd, check=True)
+
+    info(f"[OK] PMTiles salvo: {OUT_PMTILES}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+utils.py
+Funções compartilhadas pelos scripts do pipeline (interseção PRODES × anéis e sua gravação).
+Importadas com `from utils import ...` (a pasta scripts/ entra no sys.path ao rodar os scripts).
+"""
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import os
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import shapely
+
+INTER_ROW_GROUP_SIZE = 50_000   # row groups pequenos + ordem por ano => leitor Parquet descarta blocos pelo min/max
+INTER_CHUNK_SIZE = 50_000   # polígonos PRODES por lote na interseção (memória dos pares candidatos limitada)
+WORKERS = os.cpu_count() or 1   # threads p/ as ufuncs do GEOS (soltam o GIL: sem pickle de geometrias)
+
+def write_inter_geoparquet(inter: gpd.GeoDataFrame, path):
+    """
+    Grava o GeoParquet da interseção (inter_prodes_rings.parquet) sempre com as mesmas opções —
+    GeoParquet 1.1, zstd, row groups pequenos e coluna de cobertura 'bbox' — seja em 04, 05 ou 07.
+    """
+    inter.to_parquet(path, index=False, compression="zstd", schema_version="1.1.0",
+                     row_group_size=INTER_ROW_GROUP_SIZE, write_covering_bbox=True)
+
+def empty_inter(year_col: str, crs, map_crs="EPSG:4326") -> gpd.GeoDataFrame:
+    """Interseção vazia com o mesmo schema do GeoParquet cheio (inclusive geom_map), p/ write_inter_geoparquet."""
+    return gpd.GeoDataFrame({
+        "ring_id": pd.Series(dtype=str), year_col: pd.Series(dtype="int64"), "area_ha": pd.Series(dtype=float),
+        "geometry": gpd.GeoSeries([], crs=crs), "geom_map": gpd.GeoSeries([], crs=map_crs),
+    }, geometry="geometry", crs=crs)
+
+def write_table(df: pd.DataFrame | pa.Table, csv_path: Path):
+    """Agregado em CSV (escritor em C++ do PyArrow) e em Parquet ao lado, tipado, sem re-parse na leitura."""
+    table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+    pa_csv.write_csv(table, csv_path)
+    pq.write_table(table, csv_path.with_suffix(".parquet"), compression="zstd")
+
+def sql_str(path: Path) -> str:
+    """Caminho como literal SQL escapado, p/ onde o DuckDB não aceita parâmetros `?` (VIEW, COPY ... TO)."""
+    return "'" + path.as_posix().replace("'", "''") + "'"
+
+def threaded(func, *arrays):
+    """Aplica uma ufunc do shapely em fatias paralelas (threads) e junta o resultado na ordem."""
+    n = len(arrays[0])
+    if WORKERS == 1 or n < 2 * WORKERS:
+        return func(*arrays)
+    cuts = np.array_split(np.arange(n), WORKERS)
+    with ThreadPoolExecutor(max_workers=WORKERS) as ex:
+        parts = list(ex.map(lambda ix: func(*(arr[ix] for arr in arrays)), cuts))
+    return np.concatenate(parts)
+
+def intersect_rings(prodes: gpd.GeoDataFrame, rings: gpd.GeoDataFrame,
+                    chunk_size: int = INTER_CHUNK_SIZE) -> gpd.GeoDataFrame:
+    """
+    PRODES ∩ anéis sem gpd.overlay (motor único de 04, 04_analyze e 05): o STRtree dos anéis é
+    montado uma vez e consultado em lote por fatias de `chunk_size` polígonos (memória dos pares
+    candidatos limitada); se um lado contém o outro a interseção é a própria geometria contida e
+    só os pares que cruzam a borda passam pelo shapely.intersection, em threads.
+    Devolve os atributos do PRODES + ring_id, prodes_idx (rótulo do índice recebido) e inside.
+    """
+    geoms = prodes.geometry.values.copy()
+    bad = ~shapely.is_valid(geoms) & ~shapely.is_missing(geoms)   # inválido derruba o GEOS: conserta só esses
+    if bad.any():
+        geoms[bad] = shapely.make_valid(geoms[bad])
+    ring_geoms = rings.geometry.values
+    tree = shapely.STRtree(ring_geoms)
+    # anéis preparados (índice de arestas do GEOS montado uma vez e reusado por todos os pares do anel)
+    shapely.prepare(ring_geoms)
+
+    p_parts, r_parts, g_parts, in_parts = [], [], [], []
+    for start in range(0, len(geoms), chunk_size):
+        p_idx, r_idx = tree.query(geoms[start:start + chunk_size], predicate="intersects")
+        order = np.lexsort((r_idx, p_idx))   # ordem original do PRODES
+        p_idx, r_idx = p_idx[order] + start, r_idx[order]
+        a, b = geoms[p_idx], ring_geoms[r_idx]
+        # um contém o outro (caso comum: polígono inteiro dentro do anel): predicados são bem mais
+        # baratos que construir a interseção no GEOS
+        a_in_b = threaded(shapely.contains_properly, b, a)
+        b_in_a = ~a_in_b & threaded(shapely.contains_properly, a, b)
+        out_geoms = np.where(a_in_b, a, b)
+        cross = ~(a_in_b | b_in_a)
+        out_geoms[cross] = threaded(shapely.intersection, a[cross], b[cross])
+        p_parts.append(p_idx); r_parts.append(r_idx); g_parts.append(out_geoms); in_parts.append(a_in_b)
+    cat = lambda parts, dtype: np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+    p_idx, r_idx = cat(p_parts, np.intp), cat(r_parts, np.intp)
+    out_geoms, inside = cat(g_parts, object), cat(in_parts, bool)
+
+    out = prodes.iloc[p_idx].reset_index(drop=True)
+    out = out.set_geometry(gpd.GeoSeries(out_geoms, index=out.index, crs=prodes.crs))
+    out["ring_id"] = rings["ring_id"].to_numpy()[r_idx]
+    # rótulo do índice do PRODES recebido (não a posição): filtros antes desta função mantêm os rótulos,
+    # então, com o PRODES lido sem reindexar, aponta para a linha do arquivo de origem
+    out["prodes_idx"] = prodes.index.to_numpy()[p_idx].astype(np.int32)
+    out["inside"] = inside                       # polígono inteiro dentro do anel (sem interseção)
+    out = out[~shapely.is_empty(out.geometry.values)]
+    # pares que só tocam a borda viram linha/ponto: fica só a parte poligonal (como o overlay)
+    gc = out.geom_type == "GeometryCollection"
+    if gc.any():
+        out = pd.concat([out[~gc], out[gc].explode(index_parts=False)]).sort_index(kind="stable")
+    return out[out.geom_type.isin(["Polygon", "MultiPolygon"])].reset_index(drop=True)